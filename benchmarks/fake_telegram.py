@@ -0,0 +1,59 @@
+# benchmarks/fake_telegram.py
+import asyncio
+import itertools
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+from aiohttp import web
+
+
+class FakeTelegramServer:
+    """Bot API в том же процессе: принимает запросы aiogram по HTTP и отвечает
+    правдоподобными объектами. Считает вызовы по методам, может добавлять задержку"""
+
+    def __init__(self, host: str = "127.0.0.1", latency: float = 0.0):
+        self.host = host
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ""
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://{self.host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        self.calls[method] += 1
+        params = dict(await request.post())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    def _result(self, method: str, params: Dict):
+        if method in ("sendmessage", "editmessagetext"):
+            chat_id = int(params["chat_id"])
+            message_id = int(params["message_id"]) if "message_id" in params else next(self._message_ids)
+            return {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+                "text": params.get("text", "")
+            }
+        if method == "getme":
+            return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        return True
\ No newline at end of file
@@ -0,0 +1,73 @@
+# benchmarks/fsm_storage.py
+"""Задержка get/set FSM-хранилищ: MemoryStorage против SqliteFSMStorage.
+
+Запуск: python -m benchmarks.fsm_storage --sessions 1000 --rounds 5
+
+Каждый раунд повторяет для всех диалогов шаги мастера создания турнира:
+set_state, update_data, get_state, get_data. Для SqliteFSMStorage отдельно
+показано, сколько пачек ушло на диск и сколько заняло закрытие с финальной записью.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from benchmarks.tournament_load import percentile
+from storage.fsm import SqliteFSMStorage
+
+
+async def measure(storage: BaseStorage, sessions: int, rounds: int) -> Dict[str, List[float]]:
+    timings: Dict[str, List[float]] = defaultdict(list)
+    keys = [StorageKey(bot_id=1, chat_id=user_id, user_id=user_id) for user_id in range(sessions)]
+    steps = (
+        ("set_state", lambda key, i: storage.set_state(key, f"TournamentCreation:step{i % 2}")),
+        ("update_data", lambda key, i: storage.update_data(key, {"players_count": i})),
+        ("get_state", lambda key, i: storage.get_state(key)),
+        ("get_data", lambda key, i: storage.get_data(key))
+    )
+    for i in range(rounds):
+        for name, step in steps:
+            for key in keys:
+                started = time.perf_counter()
+                await step(key, i)
+                timings[name].append(time.perf_counter() - started)
+    return timings
+
+
+async def run(sessions: int, rounds: int, flush_interval: float):
+    directory = tempfile.mkdtemp(prefix="tourbot-fsm-")
+    storages = {
+        "memory": MemoryStorage(),
+        "sqlite": SqliteFSMStorage(os.path.join(directory, "fsm.sqlite3"), flush_interval=flush_interval)
+    }
+    print(f"{'хранилище':>10} {'операция':>12} {'p50 мкс':>9} {'p99 мкс':>9} {'max мкс':>9}")
+    for name, storage in storages.items():
+        timings = await measure(storage, sessions, rounds)
+        for operation, values in timings.items():
+            print(
+                f"{name:>10} {operation:>12} {percentile(values, 0.5) * 1e6:>9.1f} "
+                f"{percentile(values, 0.99) * 1e6:>9.1f} {max(values) * 1e6:>9.1f}"
+            )
+        started = time.perf_counter()
+        await storage.close()
+        if isinstance(storage, SqliteFSMStorage):
+            print(f"{name:>10} пачек записи: {storage.flushes}, закрытие: {(time.perf_counter() - started) * 1000:.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Задержка get/set FSM-хранилищ")
+    parser.add_argument("--sessions", type=int, default=1000, help="одновременных диалогов")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.sessions, args.rounds, args.flush_interval))
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
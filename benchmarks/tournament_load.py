@@ -0,0 +1,276 @@
+# benchmarks/tournament_load.py
+"""Нагрузочный прогон полного турнира против фейкового Bot API.
+
+Все размеры:  python -m benchmarks.tournament_load
+Выбранные:    python -m benchmarks.tournament_load 16 64 --api-latency 0.05
+
+Настоящий диспетчер из main.py получает синтетические апдейты: игроки
+регистрируются кнопкой join_tournament_, подключаются кнопкой connect_ и
+бросают кубики, пока сетка не определит победителя. Каждый размер идет в
+отдельном процессе и своем временном каталоге, поэтому база и пиковая
+память (ru_maxrss) разных прогонов не смешиваются.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from benchmarks.fake_telegram import FakeTelegramServer
+
+DEFAULT_SIZES = (16, 64, 256, 1024)
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class VirtualClock:
+    """Часы ограничителя частоты: между раундами двигаются вперед,
+    чтобы лимиты вели себя как при живой игре, а прогон не ждал минутами"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+class TournamentDriver:
+    """Игроки турнира: собирают апдейты и замеряют их обработку диспетчером"""
+
+    def __init__(self, dp, bot, db, chat_id: int, clock: VirtualClock, seed: int = 0):
+        self.dp = dp
+        self.bot = bot
+        self.db = db
+        self.chat_id = chat_id
+        self.clock = clock
+        self.random = random.Random(seed)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self._update_ids = itertools.count(1)
+
+    @staticmethod
+    def user(username: str) -> Dict:
+        return {"id": 100000 + int(username[1:]), "is_bot": False, "first_name": username, "username": username}
+
+    async def feed(self, kind: str, payload: Dict):
+        from aiogram.types import Update
+        update_id = next(self._update_ids)
+        update = Update.model_validate({"update_id": update_id, **payload}, context={"bot": self.bot})
+        started = time.perf_counter()
+        await self.dp.feed_update(self.bot, update)
+        self.latencies[kind].append(time.perf_counter() - started)
+
+    async def press(self, kind: str, username: str, data: str):
+        await self.feed(kind, {"callback_query": {
+            "id": f"cb{username}{data}",
+            "from": self.user(username),
+            "chat_instance": "bench",
+            "data": data
+        }})
+
+    async def throw(self, username: str):
+        await self.feed("dice", {"message": {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": self.chat_id, "type": "supergroup"},
+            "from": self.user(username),
+            "dice": {"emoji": "🎲", "value": self.random.randint(1, 6)}
+        }})
+
+    async def register(self, tournament_id: str, usernames: List[str]):
+        """Все игроки жмут кнопку регистрации одновременно"""
+        await asyncio.gather(*(self.press("join", username, f"join_tournament_{tournament_id}") for username in usernames))
+
+    async def play(self, lobby_id: str, usernames: List[str]):
+        await asyncio.gather(*(self.press("connect", username, f"connect_{lobby_id}") for username in usernames))
+        for _ in range(20):
+            await asyncio.gather(*(self._throw_twice(username) for username in usernames))
+            if self.db.get_lobby(lobby_id) is None:
+                return
+            # Ничья: переброс идет уже в следующем окне лимитов
+            self.clock.advance(61)
+        raise RuntimeError(f"Лобби {lobby_id} не завершилось")
+
+    async def _throw_twice(self, username: str):
+        await self.throw(username)
+        await self.throw(username)
+
+
+async def wait_for(predicate, timeout: float, what: str):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Не дождались: {what}")
+        await asyncio.sleep(0.01)
+
+
+async def simulate(players: int, api_latency: float) -> Dict:
+    """Один турнир на players игроков в текущем каталоге"""
+    # Подмены делаются до импорта main: хендлеры берут зависимости при импорте
+    import dependencies
+    from cache import CacheManager
+    from outbox import EditCoalescer, Outbox
+
+    clock = VirtualClock()
+    dependencies.cache_manager = CacheManager(timer=clock)
+    # Лимиты Telegram сняты: меряем бота, а не ожидание в очереди отправки
+    dependencies.outbox = Outbox(
+        lambda: dependencies.get_bot(), global_rate=1e6, chat_rate=1e6, group_rate=1e6, chat_burst=10**6
+    )
+    dependencies.edit_coalescer = EditCoalescer(dependencies.outbox, lambda: dependencies.get_bot())
+
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    import main
+    import metrics
+    from config import ADMIN_IDS, ALLOWED_CHAT_ID
+    from services.tournament_service import create_tournament_command
+
+    server = FakeTelegramServer(latency=api_latency)
+    base_url = await server.start()
+    bot = main.build_bot(AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+    dp = main.build_dispatcher()
+
+    db = dependencies.get_db()
+    scheduler = dependencies.get_scheduler()
+    outbox = dependencies.get_outbox()
+    await db.open()
+    await db.start_background_writer()
+    await scheduler.start()
+    await outbox.start()
+
+    driver = TournamentDriver(dp, bot, db, ALLOWED_CHAT_ID, clock)
+    usernames = [f"p{i}" for i in range(players)]
+    tournament_id = await create_tournament_command(ADMIN_IDS[0], players, 1)
+
+    started = time.perf_counter()
+    await driver.register(tournament_id, usernames)
+    await wait_for(
+        lambda: db.get_tournament(tournament_id).status in ("started", "completed"), 60, "старт турнира"
+    )
+
+    played = set()
+    while db.get_tournament(tournament_id).status != "completed":
+        lobbies = [
+            lobby for lobby in db.get_all_lobbies().values()
+            if lobby.tournament_id == tournament_id and lobby.lobby_id not in played
+        ]
+        if not lobbies:
+            await wait_for(
+                lambda: db.get_tournament(tournament_id).status == "completed" or any(
+                    lobby.tournament_id == tournament_id and lobby.lobby_id not in played
+                    for lobby in db.get_all_lobbies().values()
+                ),
+                60, "следующий раунд"
+            )
+            continue
+        clock.advance(61)
+        played.update(lobby.lobby_id for lobby in lobbies)
+        await asyncio.gather(*(driver.play(lobby.lobby_id, list(lobby.players)) for lobby in lobbies))
+    elapsed = time.perf_counter() - started
+
+    dependencies.get_edit_coalescer().flush()
+    await outbox.stop()
+    await scheduler.stop()
+    await db.close()
+    await bot.session.close()
+    await server.stop()
+
+    updates = sum(len(values) for values in driver.latencies.values())
+    writer = db.get_writer_stats()
+    disk_bytes = sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk("data") for name in names
+    )
+    return {
+        "players": players,
+        "updates": updates,
+        "seconds": round(elapsed, 3),
+        "throughput": round(updates / elapsed, 1),
+        "handlers": {
+            kind: {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 0.5) * 1000, 3),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+                "max_ms": round(max(values) * 1000, 3)
+            }
+            for kind, values in driver.latencies.items()
+        },
+        "db": {
+            "flushes": writer["flushes"],
+            "records_written": writer["records_written"],
+            "coalesced_writes": writer["coalesced_writes"],
+            "records_per_update": round(writer["records_written"] / updates, 3),
+            "disk_bytes": disk_bytes
+        },
+        "api_calls": dict(server.calls),
+        "rate_limited": metrics.rate_limit_rejections.total(),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+def run_single(players: int, api_latency: float) -> Dict:
+    os.chdir(tempfile.mkdtemp(prefix="tourbot-bench-"))
+    return asyncio.run(simulate(players, api_latency))
+
+
+def run_isolated(players: int, api_latency: float) -> Dict:
+    """Прогон в отдельном процессе; результат - последняя строка вывода"""
+    completed = subprocess.run(
+        [sys.executable, "-m", "benchmarks.tournament_load", "--run", str(players), "--api-latency", str(api_latency)],
+        cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Прогон на {players} игроков упал:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def print_report(results: List[Dict]):
+    print(f"{'игроков':>8} {'апдейтов':>9} {'сек':>8} {'апд/с':>8} {'записей/апд':>12} {'flush':>6} {'API':>6} {'RSS МБ':>7} {'лимит':>6}")
+    for result in results:
+        print(
+            f"{result['players']:>8} {result['updates']:>9} {result['seconds']:>8} {result['throughput']:>8} "
+            f"{result['db']['records_per_update']:>12} {result['db']['flushes']:>6} "
+            f"{sum(result['api_calls'].values()):>6} {result['peak_rss_mb']:>7} {result['rate_limited']:>6}"
+        )
+    print()
+    print(f"{'игроков':>8} {'хендлер':>8} {'апдейтов':>9} {'p50 мс':>9} {'p99 мс':>9} {'max мс':>9}")
+    for result in results:
+        for kind, stats in result["handlers"].items():
+            print(f"{result['players']:>8} {kind:>8} {stats['count']:>9} {stats['p50_ms']:>9} {stats['p99_ms']:>9} {stats['max_ms']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон турнира против фейкового Bot API")
+    parser.add_argument("sizes", nargs="*", type=int, default=list(DEFAULT_SIZES), help="число игроков")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, секунд")
+    parser.add_argument("--json", action="store_true", help="вывести результаты в JSON")
+    parser.add_argument("--run", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_single(args.run, args.api_latency), ensure_ascii=False))
+        return
+
+    results = [run_isolated(players, args.api_latency) for players in args.sizes]
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_report(results)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -1,26 +1,60 @@
 # cache.py
 import time
-from typing import Dict, Any, Optional
-from cachetools import TTLCache
+from typing import Callable, Dict, Any, Iterable, Optional, Tuple
+from cachetools import TTLCache, TLRUCache
+
+_TAT_TOLERANCE = 1e-6  # секунды; больше шага float даже для time.time()
+
+class RateLimitState:
+    """Состояние GCRA: одно число - теоретическое время следующего запроса"""
+    
+    __slots__ = ("tat",)
+    
+    def __init__(self, tat: float):
+        self.tat = tat
+
+def _rate_limit_expiry(key, state: RateLimitState, now: float) -> float:
+    # После tat ключ неотличим от нового, его можно выбросить
+    return state.tat
 
 class CacheManager:
-    def __init__(self):
-        self.rate_limit_cache = TTLCache(maxsize=10000, ttl=60)  # 1 minute TTL
+    def __init__(self, timer: Callable[[], float] = time.monotonic):
+        self.timer = timer
+        self.rate_limit_cache = TLRUCache(maxsize=10000, ttu=_rate_limit_expiry, timer=timer)
         self.user_activity_cache = TTLCache(maxsize=5000, ttl=300)  # 5 minutes TTL
         
-    def check_rate_limit(self, key: str, limit: int, period: int) -> bool:
-        current_time = time.time()
-        user_data = self.rate_limit_cache.get(key, [])
+    def _next_tat(self, key: str, limit: int, period: float, now: float) -> Optional[float]:
+        """Новый tat, если запрос укладывается в limit за period, иначе None"""
+        state = self.rate_limit_cache.get(key)
+        tat = state.tat if state is not None and state.tat > now else now
+        tat += period / limit
+        # tat копится сложением дробей: без допуска последний запрос пачки
+        # отклонялся бы из-за ошибки округления
+        return tat if tat - now <= period + _TAT_TOLERANCE else None
         
-        # Clean old timestamps
-        user_data = [t for t in user_data if current_time - t < period]
+    def check_rate_limit(self, key: str, limit: int, period: float) -> bool:
+        return self.check_rate_limits(((key, limit, period),)) is None
         
-        if len(user_data) >= limit:
-            return False
+    def check_rate_limits(self, checks: Iterable[Tuple[str, int, float]]) -> Optional[str]:
+        """Проверка нескольких лимитов сразу: запрос учитывается, только если
+        прошли все. Возвращает ключ первого нарушенного лимита или None"""
+        now = self.timer()
+        accepted = []
+        for key, limit, period in checks:
+            tat = self._next_tat(key, limit, period, now)
+            if tat is None:
+                return key
+            accepted.append((key, tat))
             
-        user_data.append(current_time)
-        self.rate_limit_cache[key] = user_data
-        return True
+        for key, tat in accepted:
+            state = self.rate_limit_cache.get(key)
+            if state is None:
+                state = RateLimitState(tat)
+            else:
+                state.tat = tat
+            # Перезапись обновляет срок жизни ключа
+            self.rate_limit_cache[key] = state
+        return None
         
     def get_user_activity(self, user_id: int) -> Dict[str, Any]:
         return self.user_activity_cache.get(user_id, {})
@@ -7,5 +7,48 @@ ALLOWED_CHAT_ID: Final = -1003026944355  # ID чата где проходят 
 ALLOWED_CHANNEL_ID: Final = -1002958222504  # ID канала где публикуются турниры
 LOBBY_TIMEOUT: Final = 300  # 5 минут в секундах для подключения
 GAME_TIMEOUT: Final = 300   # 5 минут в секундах для игры
+DICE_PENDING_TTL: Final = 60  # сколько первый кубик ждет второй
 MIN_TOURNAMENT_TIMEOUT: Final = 5 * 3600  # 5 часов минимум
-MAX_TOURNAMENT_TIMEOUT: Final = 12 * 3600  # 12 часов максимум
\ No newline at end of file
+MAX_TOURNAMENT_TIMEOUT: Final = 12 * 3600  # 12 часов максимум
+
+DB_ENGINE: Final = "journal"  # "journal" или "sqlite"
+DB_PATH: Final = "data/games.json"
+DB_SQLITE_PATH: Final = "data/games.sqlite3"  # переносится из JSON через python -m storage.migrate
+DB_FLUSH_INTERVAL: Final = 1.0  # не чаще одной записи на диск в секунду
+DB_FLUSH_MAX_PENDING: Final = 500  # или раньше, если накопилось столько изменений
+HISTORY_CACHE_SIZE: Final = 1000  # завершенных игр, подгруженных из хранилища по запросу
+FSM_STORAGE_PATH: Final = "data/fsm.sqlite3"  # состояния мастера создания турнира
+FSM_STATE_TTL: Final = 3600  # брошенный мастер забывается через час
+FSM_FLUSH_INTERVAL: Final = 1.0  # переходы пишутся на диск пачкой не чаще раза в секунду
+FSM_MAX_SESSIONS: Final = 10000
+
+OUTBOX_GLOBAL_RATE: Final = 25  # сообщений в секунду на всего бота (лимит Telegram ~30)
+OUTBOX_CHAT_RATE: Final = 1.0  # сообщений в секунду в личный чат
+OUTBOX_GROUP_RATE: Final = 20 / 60  # в группу или канал не больше 20 в минуту
+OUTBOX_CHAT_BURST: Final = 3  # сколько сообщений в чат можно отправить подряд
+EDIT_COALESCE_INTERVAL: Final = 3.0  # одно сообщение правится не чаще раза в 3 секунды
+EDIT_STATE_SIZE: Final = 1000  # сколько сообщений помнят последний отправленный текст
+EDIT_STATE_TTL: Final = 3600
+
+BOT_MODE: Final = "polling"  # "polling" или "webhook"
+WEBHOOK_BASE_URL: Final = "https://example.com"  # публичный адрес, на который Telegram шлет обновления
+WEBHOOK_PATH: Final = "/webhook"
+WEBHOOK_SECRET: Final = "change-me"  # проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST: Final = "127.0.0.1"  # адрес локального сервера за reverse proxy
+WEBHOOK_PORT: Final = 8080
+WEBHOOK_SHUTDOWN_TIMEOUT: Final = 10  # секунд на дообработку принятых обновлений при остановке
+HISTORY_RETENTION_DAYS: Final = 7  # сколько дней история хранится в базе
+HISTORY_RETENTION_INTERVAL: Final = 3600  # как часто устаревшая история уходит в архив
+HISTORY_ARCHIVE_DIR: Final = "data/archive"  # сжатые сегменты с архивом истории
+HISTORY_ARCHIVE_SEGMENT_BYTES: Final = 4 * 1024 * 1024  # размер сегмента до ротации
+HISTORY_ARCHIVE_KEEP: Final = None  # сколько последних сегментов хранить; None - хранить все
+
+METRICS_ENABLED: Final = True
+METRICS_HOST: Final = "127.0.0.1"  # /metrics только для локального сборщика
+METRICS_PORT: Final = 9100
+
+PROFILING_ENABLED: Final = False  # трассировка апдейтов по сегментам db/api/format
+PROFILING_SLOW_THRESHOLD: Final = 0.5  # секунд; дольше - отчет в PROFILING_DIR
+PROFILING_SAMPLE_RATE: Final = 0.05  # доля апдейтов, которые выполняются под cProfile
+PROFILING_DIR: Final = "data/profiles"
+PROFILING_KEEP: Final = 50  # сколько последних отчетов хранить
\ No newline at end of file
@@ -0,0 +1,2 @@
+# conftest.py
+# Корень репозитория в sys.path: тесты импортируют модули бота как есть
\ No newline at end of file
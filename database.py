@@ -1,353 +1,748 @@
 # database.py (добавляем недостающие методы)
-import json
 import os
+import copy
+import time
 import uuid
-import threading
 import asyncio
-from typing import Dict, List, Optional, Any
+import itertools
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, Any
 from datetime import datetime
-from cachetools import TTLCache
+from cachetools import LRUCache
 
+import metrics
+from profiling import traced_methods
+from models import MODELS, HistoryRecord, Lobby, PlayerSlot, Tournament
+
+from storage.archive import HistoryArchive
+from storage.journal import JournalStorage
+from storage.sqlite import SqliteStorage
+
+STORAGE_ENGINES = {
+    "journal": JournalStorage,
+    "sqlite": SqliteStorage
+}
+
+@traced_methods("db")
 class Database:
-    def __init__(self, file_path: str = "data/games.json"):
+    def __init__(
+        self,
+        file_path: str = "data/games.json",
+        engine: str = "journal",
+        compact_every: int = 1000,
+        flush_interval: float = 1.0,
+        flush_max_pending: int = 500,
+        history_cache_size: int = 1000,
+        history_archive: Optional[HistoryArchive] = None
+    ):
         self.file_path = file_path
         self._ensure_directory_exists()
-        self.lock = threading.RLock()
-        self.write_lock = threading.Lock()
-        self._write_queue = asyncio.Queue()
-        self._is_writing = False
-        self._cache = TTLCache(maxsize=1000, ttl=300)
+        self._storage = STORAGE_ENGINES[engine](file_path, compact_every)
+        self._data: Optional[Dict] = None
+
+        # Состояние не вытесняется по времени; кэшируется только холодная история
+        self._history_cache = LRUCache(maxsize=history_cache_size)
+        self._history_archive = history_archive
+
+        # Вторичный индекс активных лобби: (chat_id, username в нижнем регистре) -> {lobby_id: username}.
+        # У игрока может быть несколько активных лобби в чате (турнирный матч и /game от админа)
+        self._player_index: Dict[tuple, Dict[str, str]] = {}
+
+        # Число незавершенных лобби каждого турнира и подписчики на завершение лобби
+        self._tournament_lobbies: Dict[str, int] = {}
+        self._lobby_closed_listeners: List[Callable[[Lobby], None]] = []
+
+        # Агрегаты для /stats и мониторинга; меняются вместе с состоянием
+        self._lobby_statuses: Counter = Counter()
+        self._history_statuses: Counter = Counter()
+        self._tournament_statuses: Counter = Counter()
+        self._registered_players = 0
+
+        # Весь дисковый ввод-вывод и кодирование JSON идут в одном потоке писателя,
+        # а asyncio.Lock упорядочивает обращения к нему со стороны event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._io_lock = asyncio.Lock()
+
+        # Изменения, ожидающие записи: (таблица, ключ) -> значение или None для удаления
+        self.flush_interval = flush_interval
+        self.flush_max_pending = flush_max_pending
+        self._dirty: Dict[tuple, Any] = {}
+        # Версия последнего изменения ключа, пока оно не записано: откат неудачной
+        # записи возвращает только ключи, которые с тех пор не менялись
+        self._dirty_versions: Dict[tuple, int] = {}
+        self._dirty_seq = itertools.count(1)
+        # Запись и учет после нее не разрываются остановкой писателя
+        self._flush_lock = asyncio.Lock()
+        self._transaction_depth = 0
+        self._dirty_event = asyncio.Event()
+        self._budget_event = asyncio.Event()
+        self._writer_task = None
+        self.writer_stats = {
+            "flushes": 0,
+            "coalesced_writes": 0,
+            "records_written": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0
+        }
 
     def _ensure_directory_exists(self):
         os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
 
-    def _read_data(self) -> Dict:
-        with self.lock:
-            try:
-                with open(self.file_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except (FileNotFoundError, json.JSONDecodeError):
-                return {"lobbies": {}, "history": {}, "tournaments": {}, "temp_dice": {}}
-
-    async def _write_data_async(self, data: Dict):
-        with self.write_lock:
-            try:
-                temp_file = self.file_path + '.tmp'
-                with open(temp_file, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=4)
-                
-                if os.path.exists(self.file_path):
-                    os.replace(temp_file, self.file_path)
-                else:
-                    os.rename(temp_file, self.file_path)
-                    
-            except Exception as e:
-                print(f"Error writing database: {e}")
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-
-    def _write_data_sync(self, data: Dict):
-        with self.write_lock:
-            try:
-                temp_file = self.file_path + '.tmp'
-                with open(temp_file, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=4)
-                
-                if os.path.exists(self.file_path):
-                    os.replace(temp_file, self.file_path)
-                else:
-                    os.rename(temp_file, self.file_path)
-                    
-            except Exception as e:
-                print(f"Error writing database: {e}")
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
+    async def _run_io(self, func, *args):
+        """Выполнение операции с хранилищем в потоке писателя"""
+        async with self._io_lock:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+
+    async def open(self):
+        """Загрузка состояния с диска (вызывается один раз при старте)"""
+        if self._data is not None:
+            # Повторное чтение затерло бы изменения, еще не дошедшие до диска
+            return
+        state = await self._run_io(self._storage.load)
+        state["lobbies"] = {key: Lobby.from_dict(value) for key, value in state["lobbies"].items()}
+        state["tournaments"] = {key: Tournament.from_dict(value) for key, value in state["tournaments"].items()}
+        self._data = state
+
+        self._player_index = {}
+        self._tournament_lobbies = {}
+        for lobby_data in self._data["lobbies"].values():
+            self._index_lobby(lobby_data)
+            self._count_tournament_lobby(lobby_data.tournament_id, 1)
+
+        # Единственный полный проход по счетчикам - при загрузке
+        self._lobby_statuses = Counter(lobby_data.status for lobby_data in self._data["lobbies"].values())
+        self._tournament_statuses = Counter(t.status for t in self._data["tournaments"].values())
+        self._registered_players = sum(len(t.participants) for t in self._data["tournaments"].values())
+        self._history_statuses = Counter(await self._run_io(self._storage.history_status_counts))
+
+    def _write_records(self, records: List[Dict]) -> bool:
+        try:
+            self._storage.append(records)
+            if self._storage.should_compact():
+                self._storage.compact()
+            return True
+        except Exception as e:
+            print(f"Error writing database: {e}")
+            return False
 
     async def _background_writer(self):
         while True:
             try:
-                data = await self._write_queue.get()
-                await self._write_data_async(data)
-                self._write_queue.task_done()
+                await self._dirty_event.wait()
+
+                # Собираем серию изменений в одну запись, но не дольше flush_interval
+                try:
+                    await asyncio.wait_for(self._budget_event.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 print(f"Background writer error: {e}")
 
-    def _get_cached_data(self) -> Dict:
-        cached = self._cache.get('data')
-        if cached is None:
-            cached = self._read_data()
-            self._cache['data'] = cached
-        return cached
+    def _mark_dirty(self, table: str, key: str, value: Any):
+        dirty_key = (table, key)
+        if dirty_key in self._dirty:
+            self.writer_stats["coalesced_writes"] += 1
+        self._dirty[dirty_key] = value
+        self._dirty_versions[dirty_key] = next(self._dirty_seq)
+
+        self._dirty_event.set()
+        if len(self._dirty) >= self.flush_max_pending and not self._transaction_depth:
+            self._budget_event.set()
+
+    def _log_put(self, table: str, key: str, value: Any):
+        """Постановка в журнал новой версии записи"""
+        self._mark_dirty(table, key, value)
+
+    def _log_delete(self, table: str, key: str):
+        """Постановка в журнал удаления записи"""
+        if table == "history":
+            self._history_cache.pop(key, None)
+        self._mark_dirty(table, key, None)
+
+    @contextmanager
+    def transaction(self):
+        """Группа изменений, которая попадает на диск одной пачкой.
+        
+        Пока транзакция открыта, фоновая запись ее не разрезает: все изменения
+        уходят в хранилище вместе (одна строка журнала или одна транзакция
+        SQLite), поэтому после падения на диске либо все, либо ничего.
+        Изменения в памяти при исключении не откатываются. Транзакции
+        вкладываются; держать их открытыми через долгие await не стоит"""
+        self._transaction_depth += 1
+        try:
+            yield self
+        finally:
+            self._transaction_depth -= 1
+            if not self._transaction_depth and self._dirty:
+                self._dirty_event.set()
+                if len(self._dirty) >= self.flush_max_pending:
+                    self._budget_event.set()
+
+    async def flush(self):
+        """Запись накопленных изменений одной пачкой"""
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        self._dirty_event.clear()
+        self._budget_event.clear()
+        if not self._dirty or self._transaction_depth:
+            # Открытая транзакция допишется целиком после выхода из нее
+            return
+
+        dirty, self._dirty = self._dirty, {}
+        versions = {dirty_key: self._dirty_versions[dirty_key] for dirty_key in dirty}
+
+        # Снимки изменившихся записей: обработчики продолжают менять оригиналы,
+        # пока поток писателя их кодирует. Модели превращаются в словари только здесь
+        records = []
+        for (table, key), value in dirty.items():
+            record = {"t": table, "k": key}
+            if value is not None:
+                record["v"] = value.to_dict() if table in MODELS else copy.deepcopy(value)
+            records.append(record)
+
+        started = time.perf_counter()
+        written = await asyncio.shield(self._run_io(self._write_records, records))
+        if not written:
+            # Не теряем изменения, но и не возвращаем устаревшие: если ключ с тех пор
+            # менялся, более свежая версия уже в _dirty или записана другой пачкой
+            for dirty_key, value in dirty.items():
+                if self._dirty_versions.get(dirty_key) == versions[dirty_key]:
+                    self._dirty[dirty_key] = value
+            self._dirty_event.set()
+            return
+
+        for dirty_key, version in versions.items():
+            if self._dirty_versions.get(dirty_key) == version:
+                del self._dirty_versions[dirty_key]
+
+        elapsed = time.perf_counter() - started
+        metrics.db_flush_seconds.observe(elapsed)
+        elapsed_ms = elapsed * 1000
+        stats = self.writer_stats
+        stats["flushes"] += 1
+        stats["records_written"] += len(records)
+        stats["last_flush_ms"] = elapsed_ms
+        stats["max_flush_ms"] = max(stats["max_flush_ms"], elapsed_ms)
+        stats["total_flush_ms"] += elapsed_ms
+
+    def _move_count(self, counter: Counter, old: Optional[str], new: Optional[str]):
+        if old is not None:
+            counter[old] -= 1
+            if counter[old] <= 0:
+                del counter[old]
+        if new is not None:
+            counter[new] += 1
+
+    def get_counters(self) -> Dict:
+        """Текущие агрегаты за O(1), без обращения к диску"""
+        history = self._history_statuses
+        return {
+            "active_lobbies": sum(self._lobby_statuses.values()),
+            "lobbies_by_status": dict(self._lobby_statuses),
+            "finished_games": sum(history.values()),
+            "history_by_status": dict(history),
+            "draws": history["draw"],
+            "timeouts": history["timeout"],
+            "tournaments": sum(self._tournament_statuses.values()),
+            "tournaments_by_status": dict(self._tournament_statuses),
+            "registered_players": self._registered_players
+        }
+
+    def get_writer_stats(self) -> Dict:
+        """Счетчики фоновой записи"""
+        stats = dict(self.writer_stats)
+        stats["pending"] = len(self._dirty)
+        return stats
 
-    def _update_cache(self, new_data: Dict):
-        self._cache['data'] = new_data
+    def _get_state(self) -> Dict:
+        """Авторитетное состояние в памяти; на диск попадает только через _mark_dirty"""
+        if self._data is None:
+            raise RuntimeError("База не загружена: сначала вызовите Database.open()")
+        return self._data
 
     # ========== ТУРНИРНЫЕ МЕТОДЫ ==========
 
     def update_tournament_message_id(self, tournament_id: str, message_id: int):
         """Обновление ID сообщения турнира в канале"""
-        data = self._get_cached_data()
+        data = self._get_state()
         
-        if "tournaments" in data and tournament_id in data["tournaments"]:
-            data["tournaments"][tournament_id]["channel_message_id"] = message_id
-            self._update_cache(data)
-            self._write_queue.put_nowait(data)
+        tournament = data["tournaments"].get(tournament_id)
+        if tournament:
+            tournament.channel_message_id = message_id
+            self._log_put("tournaments", tournament_id, tournament)
 
-    def get_tournament_by_lobby(self, lobby_id: str) -> Optional[Dict]:
+    def get_tournament_by_lobby(self, lobby_id: str) -> Optional[Tournament]:
         """Получение турнира по ID лобби"""
-        data = self._get_cached_data()
+        data = self._get_state()
         lobby = data["lobbies"].get(lobby_id)
-        if not lobby or not lobby.get("tournament_id"):
+        if not lobby or not lobby.tournament_id:
             return None
         
-        tournament_id = lobby["tournament_id"]
-        return data.get("tournaments", {}).get(tournament_id)
+        return data["tournaments"].get(lobby.tournament_id)
 
-    def get_active_tournaments(self) -> List[Dict]:
+    def get_active_tournaments(self) -> List[Tournament]:
         """Получение активных турниров"""
-        data = self._get_cached_data()
+        data = self._get_state()
         active_tournaments = []
         
-        for tournament_id, tournament_data in data.get("tournaments", {}).items():
-            if tournament_data["status"] in ["registration", "in_progress"]:
+        for tournament_id, tournament_data in data["tournaments"].items():
+            if tournament_data.status in ["registration", "in_progress"]:
                 active_tournaments.append(tournament_data)
                 
         return active_tournaments
 
     def update_tournament_round(self, tournament_id: str, round_number: int):
         """Обновление текущего раунда турнира"""
-        data = self._get_cached_data()
+        data = self._get_state()
         
-        if "tournaments" in data and tournament_id in data["tournaments"]:
-            data["tournaments"][tournament_id]["current_round"] = round_number
-            self._update_cache(data)
-            self._write_queue.put_nowait(data)
+        tournament = data["tournaments"].get(tournament_id)
+        if tournament:
+            tournament.current_round = round_number
+            self._log_put("tournaments", tournament_id, tournament)
             return True
         return False
 
-    def clear_old_data(self, days: int = 7):
-        """Очистка старых данных из истории"""
-        data = self._get_cached_data()
-        cutoff_date = datetime.now().timestamp() - (days * 24 * 3600)
+    async def expire_history(self, max_age: float, batch_size: int = 500) -> int:
+        """Вытеснение истории старше max_age секунд, начиная с самых старых записей.
+        Записи попадают в архив раньше, чем их удаление - в журнал"""
+        cutoff = time.time() - max_age
+        expired_total = 0
         
-        history_to_keep = {}
-        for lobby_id, lobby_data in data.get("history", {}).items():
-            created_at = datetime.fromisoformat(lobby_data["created_at"]).timestamp()
-            if created_at > cutoff_date:
-                history_to_keep[lobby_id] = lobby_data
+        while True:
+            records = await self._run_io(self._storage.expired_history, cutoff, batch_size)
+            if not records:
+                break
+                
+            if self._history_archive is not None:
+                await self._run_io(self._history_archive.write, records)
+            for record in records:
+                self._log_delete("history", record["lobby_id"])
+                self._move_count(self._history_statuses, record["status"], None)
+            expired_total += len(records)
+            
+            # Следующая пачка читается из хранилища, где эти записи уже удалены
+            await self.flush()
+            if len(records) < batch_size or ("history", records[-1]["lobby_id"]) in self._dirty:
+                break
                 
-        data["history"] = history_to_keep
-        self._update_cache(data)
-        self._write_queue.put_nowait(data)
+        return expired_total
+
+    async def clear_old_data(self, days: int = 7) -> int:
+        """Очистка истории старше days дней"""
+        return await self.expire_history(days * 24 * 3600)
+
+    async def get_history(self, lobby_id: str) -> Optional[HistoryRecord]:
+        """Получение завершенного лобби из истории"""
+        dirty_key = ("history", lobby_id)
+        if dirty_key in self._dirty:
+            return self._dirty[dirty_key]
+        
+        lobby_data = self._history_cache.get(lobby_id)
+        if lobby_data is None:
+            record = await self._run_io(self._storage.get_history, lobby_id)
+            if record is None:
+                return None
+            lobby_data = HistoryRecord.from_dict(record)
+            if dirty_key not in self._dirty:
+                self._history_cache[lobby_id] = lobby_data
+        return lobby_data
 
     # ========== МЕТОДЫ ЛОББИ ==========
 
-    def set_lobby_tournament_id(self, lobby_id: str, tournament_id: str):
-        """Установка tournament_id для лобби"""
-        data = self._get_cached_data()
+    def _index_lobby(self, lobby_data: Lobby):
+        if lobby_data.finished:
+            self._unindex_lobby(lobby_data)
+            return
+        for username in lobby_data.players:
+            self._player_index.setdefault((lobby_data.chat_id, username.lower()), {})[lobby_data.lobby_id] = username
+
+    def _unindex_lobby(self, lobby_data: Lobby):
+        for username in lobby_data.players:
+            key = (lobby_data.chat_id, username.lower())
+            entries = self._player_index.get(key)
+            if entries is not None:
+                entries.pop(lobby_data.lobby_id, None)
+                if not entries:
+                    del self._player_index[key]
+
+    def _count_tournament_lobby(self, tournament_id: Optional[str], delta: int):
+        if not tournament_id:
+            return
+        count = self._tournament_lobbies.get(tournament_id, 0) + delta
+        if count > 0:
+            self._tournament_lobbies[tournament_id] = count
+        else:
+            self._tournament_lobbies.pop(tournament_id, None)
+
+    def count_tournament_lobbies(self, tournament_id: str) -> int:
+        """Число незавершенных лобби турнира"""
+        return self._tournament_lobbies.get(tournament_id, 0)
+
+    def add_lobby_closed_listener(self, listener: Callable[[Lobby], None]):
+        """Подписка на завершение лобби (перенос в историю или удаление)"""
+        self._lobby_closed_listeners.append(listener)
+
+    def _publish_lobby_closed(self, lobby_data: Lobby):
+        for listener in self._lobby_closed_listeners:
+            try:
+                listener(lobby_data)
+            except Exception as e:
+                print(f"Lobby listener error: {e}")
+
+    def find_player_lobby(self, chat_id: int, username: str) -> Optional[tuple]:
+        """Активное лобби игрока в чате: (lobby_id, username как в лобби) или None.
+        Из нескольких лобби выбирается то, где уже идет игра, иначе самое новое"""
+        entries = self._player_index.get((chat_id, username.lower()))
+        if not entries:
+            return None
+        if len(entries) > 1:
+            lobbies = self._get_state()["lobbies"]
+            for lobby_id, original_username in entries.items():
+                lobby_data = lobbies.get(lobby_id)
+                if lobby_data and lobby_data.status == "playing":
+                    return lobby_id, original_username
+        return next(reversed(entries.items()))
+
+    def set_lobby_tournament_id(self, lobby_id: str, tournament_id: str, bracket_node: int = None):
+        """Установка tournament_id (и узла сетки) для лобби"""
+        data = self._get_state()
         
-        if lobby_id in data["lobbies"]:
-            data["lobbies"][lobby_id]["tournament_id"] = tournament_id
-            self._update_cache(data)
-            self._write_queue.put_nowait(data)
+        lobby_data = data["lobbies"].get(lobby_id)
+        if lobby_data:
+            self._count_tournament_lobby(lobby_data.tournament_id, -1)
+            lobby_data.tournament_id = tournament_id
+            if bracket_node is not None:
+                lobby_data.bracket_node = bracket_node
+            self._count_tournament_lobby(tournament_id, 1)
+            self._log_put("lobbies", lobby_id, lobby_data)
             return True
         return False
 
     def get_tournament_id_by_lobby(self, lobby_id: str) -> Optional[str]:
         """Получение ID турнира по ID лобби"""
-        data = self._get_cached_data()
+        data = self._get_state()
         lobby = data["lobbies"].get(lobby_id)
-        return lobby.get("tournament_id") if lobby else None
+        return lobby.tournament_id if lobby else None
 
-    def create_lobby(self, chat_id: int, admin_id: int, username1: str, username2: str) -> str:
-        data = self._get_cached_data()
+    def _add_lobby(
+        self, chat_id: int, admin_id: int, username1: str, username2: str,
+        tournament_id: Optional[str] = None, bracket_node: Optional[int] = None
+    ) -> str:
+        data = self._get_state()
         lobby_id = str(uuid.uuid4())[:8]
         
-        lobby_data = {
-            "lobby_id": lobby_id,
-            "chat_id": chat_id,
-            "admin_id": admin_id,
-            "players": {
-                username1: {"connected": False, "dice": None},
-                username2: {"connected": False, "dice": None}
-            },
-            "created_at": datetime.now().isoformat(),
-            "status": "waiting",
-            "winner": None,
-            "scores": None,
-            "finished": False,
-            "tournament_id": None
-        }
+        lobby_data = Lobby(
+            lobby_id=lobby_id,
+            chat_id=chat_id,
+            admin_id=admin_id,
+            players={username1: PlayerSlot(), username2: PlayerSlot()},
+            created_at=datetime.now().isoformat(),
+            tournament_id=tournament_id,
+            bracket_node=bracket_node
+        )
         
         data["lobbies"][lobby_id] = lobby_data
-        self._update_cache(data)
-        self._write_queue.put_nowait(data)
+        self._index_lobby(lobby_data)
+        self._move_count(self._lobby_statuses, None, lobby_data.status)
+        self._count_tournament_lobby(tournament_id, 1)
+        self._log_put("lobbies", lobby_id, lobby_data)
         return lobby_id
 
+    def create_lobby(self, chat_id: int, admin_id: int, username1: str, username2: str) -> str:
+        return self._add_lobby(chat_id, admin_id, username1, username2)
+
+    def create_lobbies_bulk(
+        self,
+        chat_id: int,
+        admin_id: int,
+        matches: List[Tuple[str, str]],
+        tournament_id: Optional[str] = None,
+        bracket_nodes: Optional[List[int]] = None
+    ) -> List[str]:
+        """Создание многих лобби одной транзакцией.
+        
+        Лобби сразу получают tournament_id и узел сетки и добавляются в список
+        игр турнира, так что каждое лобби и турнир пишутся по одному разу"""
+        nodes = bracket_nodes if bracket_nodes is not None else [None] * len(matches)
+        with self.transaction():
+            lobby_ids = [
+                self._add_lobby(chat_id, admin_id, username1, username2, tournament_id, node)
+                for (username1, username2), node in zip(matches, nodes)
+            ]
+            tournament = self._get_state()["tournaments"].get(tournament_id) if tournament_id else None
+            if tournament and lobby_ids:
+                tournament.lobbies.extend(lobby_ids)
+                self._log_put("tournaments", tournament_id, tournament)
+        return lobby_ids
+
     def connect_player(self, lobby_id: str, username: str) -> bool:
-        data = self._get_cached_data()
+        data = self._get_state()
         
-        if lobby_id in data["lobbies"] and username in data["lobbies"][lobby_id]["players"]:
-            data["lobbies"][lobby_id]["players"][username]["connected"] = True
-            self._update_cache(data)
-            self._write_queue.put_nowait(data)
+        lobby_data = data["lobbies"].get(lobby_id)
+        if lobby_data and username in lobby_data.players:
+            lobby_data.players[username].connected = True
+            self._log_put("lobbies", lobby_id, lobby_data)
             return True
         
         return False
 
     def set_player_dice(self, lobby_id: str, username: str, dice_values: List[int]) -> bool:
-        data = self._get_cached_data()
+        data = self._get_state()
         
-        if lobby_id in data["lobbies"] and username in data["lobbies"][lobby_id]["players"]:
-            data["lobbies"][lobby_id]["players"][username]["dice"] = dice_values
-            self._update_cache(data)
-            self._write_queue.put_nowait(data)
+        lobby_data = data["lobbies"].get(lobby_id)
+        if lobby_data and username in lobby_data.players:
+            player = lobby_data.players[username]
+            player.dice = dice_values
+            player.pending = None
+            self._log_put("lobbies", lobby_id, lobby_data)
             return True
         
         return False
 
-    def get_lobby(self, lobby_id: str) -> Optional[Dict]:
-        data = self._get_cached_data()
+    def add_player_throw(self, lobby_id: str, username: str, value: int, ttl: float) -> Optional[List[int]]:
+        """Один кубик игрока. Первый хранится в лобби как [значение, время],
+        второй в пределах ttl завершает бросок и возвращает пару"""
+        data = self._get_state()
+        lobby_data = data["lobbies"].get(lobby_id)
+        if not lobby_data or username not in lobby_data.players:
+            return None
+            
+        player = lobby_data.players[username]
+        if player.dice is not None:
+            return None
+            
+        now = int(time.time())
+        pending = player.pending
+        if pending and now - pending[1] <= ttl:
+            player.dice = [pending[0], value]
+            player.pending = None
+        else:
+            # Просроченный первый кубик заменяется новым
+            player.pending = [value, now]
+            
+        self._log_put("lobbies", lobby_id, lobby_data)
+        return player.dice
+
+    def clear_pending_throws(self) -> int:
+        """Сброс всех недокинутых кубиков"""
+        data = self._get_state()
+        cleared = 0
+        for lobby_id, lobby_data in data["lobbies"].items():
+            changed = False
+            for player in lobby_data.players.values():
+                if player.pending is not None:
+                    player.pending = None
+                    changed = True
+                    cleared += 1
+            if changed:
+                self._log_put("lobbies", lobby_id, lobby_data)
+        return cleared
+
+    def get_lobby(self, lobby_id: str) -> Optional[Lobby]:
+        data = self._get_state()
         return data["lobbies"].get(lobby_id)
 
     def get_all_lobbies(self) -> Dict:
-        data = self._get_cached_data()
+        data = self._get_state()
         return data["lobbies"]
 
     def move_to_history(self, lobby_id: str):
-        data = self._get_cached_data()
+        data = self._get_state()
         
         if lobby_id in data["lobbies"]:
-            lobby_data = data["lobbies"][lobby_id]
-            lobby_data["finished"] = True
-            data["history"][lobby_id] = lobby_data
-            del data["lobbies"][lobby_id]
-            self._update_cache(data)
-            self._write_queue.put_nowait(data)
+            lobby_data = data["lobbies"].pop(lobby_id)
+            lobby_data.finished = True
+            self._unindex_lobby(lobby_data)
+            self._count_tournament_lobby(lobby_data.tournament_id, -1)
+            self._move_count(self._lobby_statuses, lobby_data.status, None)
+            self._move_count(self._history_statuses, None, lobby_data.status)
+            record = HistoryRecord.from_lobby(lobby_data)
+            self._history_cache[lobby_id] = record
+            self._log_put("history", lobby_id, record)
+            self._log_delete("lobbies", lobby_id)
+            self._publish_lobby_closed(lobby_data)
 
     def delete_lobby(self, lobby_id: str):
-        data = self._get_cached_data()
+        data = self._get_state()
         
         if lobby_id in data["lobbies"]:
-            del data["lobbies"][lobby_id]
-            self._update_cache(data)
-            self._write_queue.put_nowait(data)
+            lobby_data = data["lobbies"].pop(lobby_id)
+            self._unindex_lobby(lobby_data)
+            self._count_tournament_lobby(lobby_data.tournament_id, -1)
+            self._move_count(self._lobby_statuses, lobby_data.status, None)
+            self._log_delete("lobbies", lobby_id)
+            self._publish_lobby_closed(lobby_data)
 
     def update_lobby_status(self, lobby_id: str, status: str, winner: str = None, scores: Dict = None):
-        data = self._get_cached_data()
+        data = self._get_state()
         
-        if lobby_id in data["lobbies"]:
-            data["lobbies"][lobby_id]["status"] = status
+        lobby_data = data["lobbies"].get(lobby_id)
+        if lobby_data:
+            self._move_count(self._lobby_statuses, lobby_data.status, status)
+            lobby_data.status = status
 
             if winner:
-                data["lobbies"][lobby_id]["winner"] = winner
+                lobby_data.winner = winner
 
             if scores:
-                data["lobbies"][lobby_id]["scores"] = scores
+                lobby_data.scores = scores
                 
             if status in ["finished", "draw", "timeout"]:
-                data["lobbies"][lobby_id]["finished"] = True
+                lobby_data.finished = True
 
-            self._update_cache(data)
-            self._write_queue.put_nowait(data)
+            self._index_lobby(lobby_data)
+            self._log_put("lobbies", lobby_id, lobby_data)
 
     # ========== ОСНОВНЫЕ МЕТОДЫ ТУРНИРОВ ==========
 
     def create_tournament(self, chat_id: int, admin_id: int, max_players: int, hours: int) -> str:
-        data = self._get_cached_data()
+        data = self._get_state()
         tournament_id = str(uuid.uuid4())[:8]
         
-        tournament_data = {
-            "tournament_id": tournament_id,
-            "chat_id": chat_id,
-            "admin_id": admin_id,
-            "max_players": max_players,
-            "hours": hours,
-            "status": "registration",
-            "participants": [],
-            "created_at": datetime.now().isoformat(),
-            "lobbies": [],
-            "channel_message_id": None,
-            "current_round": 1
-        }
+        tournament_data = Tournament(
+            tournament_id=tournament_id,
+            chat_id=chat_id,
+            admin_id=admin_id,
+            max_players=max_players,
+            hours=hours,
+            created_at=datetime.now().isoformat()
+        )
         
-        if "tournaments" not in data:
-            data["tournaments"] = {}
-            
         data["tournaments"][tournament_id] = tournament_data
-        self._update_cache(data)
-        self._write_queue.put_nowait(data)
+        self._move_count(self._tournament_statuses, None, tournament_data.status)
+        self._log_put("tournaments", tournament_id, tournament_data)
         return tournament_id
 
-    def add_tournament_participant(self, tournament_id: str, username: str) -> bool:
-        data = self._get_cached_data()
+    def add_tournament_participant(self, tournament_id: str, username: str, expected_status: str = "registration") -> bool:
+        """Регистрация, только если турнир в статусе expected_status, есть места и игрок еще не участвует"""
+        data = self._get_state()
         
-        if "tournaments" in data and tournament_id in data["tournaments"]:
-            tournament = data["tournaments"][tournament_id]
-
-            if username not in tournament["participants"] and len(tournament["participants"]) < tournament["max_players"]:
-                tournament["participants"].append(username)
-                self._update_cache(data)
-                self._write_queue.put_nowait(data)
-                return True
+        tournament = data["tournaments"].get(tournament_id)
+        if tournament and tournament.status == expected_status and tournament.add_participant(username):
+            self._registered_players += 1
+            self._log_put("tournaments", tournament_id, tournament)
+            return True
             
         return False
 
-    def get_tournament(self, tournament_id: str) -> Optional[Dict]:
-        data = self._get_cached_data()
-        return data.get("tournaments", {}).get(tournament_id)
+    def update_tournament_bracket(self, tournament_id: str, bracket: Dict):
+        """Сохранение сетки турнира"""
+        data = self._get_state()
+        
+        tournament = data["tournaments"].get(tournament_id)
+        if tournament:
+            tournament.bracket = bracket
+            self._log_put("tournaments", tournament_id, tournament)
+
+    def get_tournament(self, tournament_id: str) -> Optional[Tournament]:
+        data = self._get_state()
+        return data["tournaments"].get(tournament_id)
 
     def update_tournament_status(self, tournament_id: str, status: str, lobbies: List[str] = None):
-        data = self._get_cached_data()
+        data = self._get_state()
         
-        if "tournaments" in data and tournament_id in data["tournaments"]:
-            data["tournaments"][tournament_id]["status"] = status
+        tournament = data["tournaments"].get(tournament_id)
+        if tournament:
+            self._move_count(self._tournament_statuses, tournament.status, status)
+            tournament.status = status
 
             if lobbies:
-                data["tournaments"][tournament_id]["lobbies"] = lobbies
+                tournament.lobbies = lobbies
+
+            self._log_put("tournaments", tournament_id, tournament)
 
-            self._update_cache(data)
-            self._write_queue.put_nowait(data)
+    def compare_and_set_tournament_status(self, tournament_id: str, expected: str, status: str) -> bool:
+        """Смена статуса, только если текущий равен expected; True, если статус сменили"""
+        tournament = self._get_state()["tournaments"].get(tournament_id)
+        if not tournament or tournament.status != expected:
+            return False
+        self.update_tournament_status(tournament_id, status)
+        return True
 
     def get_all_tournaments(self) -> Dict:
-        data = self._get_cached_data()
-        return data.get("tournaments", {})
+        data = self._get_state()
+        return data["tournaments"]
 
     def delete_tournament(self, tournament_id: str):
-        data = self._get_cached_data()
+        data = self._get_state()
         
-        if "tournaments" in data and tournament_id in data["tournaments"]:
-            del data["tournaments"][tournament_id]
-            self._update_cache(data)
-            self._write_queue.put_nowait(data)
+        if tournament_id in data["tournaments"]:
+            tournament = data["tournaments"].pop(tournament_id)
+            self._move_count(self._tournament_statuses, tournament.status, None)
+            self._registered_players -= len(tournament.participants)
+            self._log_delete("tournaments", tournament_id)
+
+    # ========== ТАЙМЕРЫ ==========
+
+    def save_timer(self, job_id: str, job: Dict):
+        """Сохранение дедлайна таймера"""
+        data = self._get_state()
+        data["timers"][job_id] = job
+        self._log_put("timers", job_id, job)
+
+    def get_timer(self, job_id: str) -> Optional[Dict]:
+        data = self._get_state()
+        return data["timers"].get(job_id)
+
+    def get_timers(self) -> Dict:
+        data = self._get_state()
+        return data["timers"]
+
+    def delete_timer(self, job_id: str):
+        data = self._get_state()
+        if job_id in data["timers"]:
+            del data["timers"][job_id]
+            self._log_delete("timers", job_id)
 
     # ========== ВРЕМЕННЫЕ ДАННЫЕ ==========
 
     def set_temp_dice(self, user_id: str, dice_values: List[int]):
-        data = self._get_cached_data()
+        data = self._get_state()
         data["temp_dice"][user_id] = {
             "dice": dice_values,
             "timestamp": datetime.now().isoformat()
         }
-        self._update_cache(data)
-        self._write_queue.put_nowait(data)
+        self._log_put("temp_dice", user_id, data["temp_dice"][user_id])
 
     def get_temp_dice(self, user_id: str) -> Optional[List[int]]:
-        data = self._get_cached_data()
+        data = self._get_state()
         user_data = data["temp_dice"].get(user_id)
         if user_data:
             return user_data["dice"]
         return None
 
     def clear_temp_dice(self, user_id: str):
-        data = self._get_cached_data()
+        data = self._get_state()
         if user_id in data["temp_dice"]:
             del data["temp_dice"][user_id]
-            self._update_cache(data)
-            self._write_queue.put_nowait(data)
+            self._log_delete("temp_dice", user_id)
 
     async def start_background_writer(self):
-        asyncio.create_task(self._background_writer())
+        if self._writer_task is None or self._writer_task.done():
+            self._writer_task = asyncio.create_task(self._background_writer())
 
     async def close(self):
-        await self._write_queue.join()
\ No newline at end of file
+        if self._writer_task is not None:
+            # Начатая писателем запись доводится до конца вместе с учетом
+            async with self._flush_lock:
+                self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+            self._writer_task = None
+
+        await self.flush()
+        await self._run_io(self._storage.sync)
+        await self._run_io(self._storage.close)
+        self._executor.shutdown(wait=True)
\ No newline at end of file
@@ -2,10 +2,48 @@
 from aiogram import Bot
 from database import Database
 from cache import CacheManager
+from scheduler import Scheduler
+from outbox import Outbox, EditCoalescer
+from utils.locks import KeyedLock
+from storage.archive import HistoryArchive
+from metrics import register_state_gauges
+from config import (
+    DB_ENGINE, DB_PATH, DB_SQLITE_PATH, DB_FLUSH_INTERVAL, DB_FLUSH_MAX_PENDING, HISTORY_CACHE_SIZE,
+    HISTORY_ARCHIVE_DIR, HISTORY_ARCHIVE_SEGMENT_BYTES, HISTORY_ARCHIVE_KEEP,
+    OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_GROUP_RATE, OUTBOX_CHAT_BURST,
+    EDIT_COALESCE_INTERVAL, EDIT_STATE_SIZE, EDIT_STATE_TTL
+)
 
 bot_instance = None
-db_instance = Database()
+db_instance = Database(
+    DB_SQLITE_PATH if DB_ENGINE == "sqlite" else DB_PATH,
+    engine=DB_ENGINE,
+    flush_interval=DB_FLUSH_INTERVAL,
+    flush_max_pending=DB_FLUSH_MAX_PENDING,
+    history_cache_size=HISTORY_CACHE_SIZE,
+    history_archive=HistoryArchive(HISTORY_ARCHIVE_DIR, HISTORY_ARCHIVE_SEGMENT_BYTES, HISTORY_ARCHIVE_KEEP)
+)
 cache_manager = CacheManager()
+scheduler = Scheduler(db_instance)
+outbox = Outbox(
+    lambda: get_bot(),
+    global_rate=OUTBOX_GLOBAL_RATE,
+    chat_rate=OUTBOX_CHAT_RATE,
+    group_rate=OUTBOX_GROUP_RATE,
+    chat_burst=OUTBOX_CHAT_BURST
+)
+edit_coalescer = EditCoalescer(
+    outbox,
+    lambda: get_bot(),
+    interval=EDIT_COALESCE_INTERVAL,
+    max_messages=EDIT_STATE_SIZE,
+    state_ttl=EDIT_STATE_TTL
+)
+register_state_gauges(db_instance, scheduler, outbox)
+
+# Порядок обработки внутри одного лобби и одного турнира
+lobby_locks = KeyedLock()
+tournament_locks = KeyedLock()
 
 def set_bot_instance(bot: Bot):
     global bot_instance
@@ -20,4 +58,19 @@ def get_db() -> Database:
     return db_instance
 
 def get_cache() -> CacheManager:
-    return cache_manager
\ No newline at end of file
+    return cache_manager
+
+def get_scheduler() -> Scheduler:
+    return scheduler
+
+def get_outbox() -> Outbox:
+    return outbox
+
+def get_edit_coalescer() -> EditCoalescer:
+    return edit_coalescer
+
+def get_lobby_locks() -> KeyedLock:
+    return lobby_locks
+
+def get_tournament_locks() -> KeyedLock:
+    return tournament_locks
\ No newline at end of file
@@ -1,50 +1,29 @@
-import asyncio
-import time
+from itertools import islice
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from config import ADMIN_IDS
-from dependencies import get_db
+from config import ADMIN_IDS, HISTORY_RETENTION_DAYS
+from dependencies import get_db, get_edit_coalescer
 from keyboards import get_admin_keyboard, get_lobby_list_keyboard, get_tournament_list_keyboard
 from services.tournament_service import create_tournament_command
+from services.retention import run_history_retention
+from outbox import PRIORITY_ADMIN
 
 router = Router()
 db = get_db()
-
-last_edit_time = {}
-EDIT_DELAY = 2.0
+edit_coalescer = get_edit_coalescer()
 
 class TournamentCreation(StatesGroup):
     waiting_for_players = State()
     waiting_for_time = State()
 
-async def safe_edit_message(chat_id, message_id, text, reply_markup=None):
-    """Safe message editing with rate limiting"""
-    current_time = time.time()
-    key = f"{chat_id}_{message_id}"
-    
-    if key in last_edit_time:
-        time_since_last = current_time - last_edit_time[key]
-        if time_since_last < EDIT_DELAY:
-            await asyncio.sleep(EDIT_DELAY - time_since_last)
-    
-    from dependencies import get_bot
-    bot = get_bot()
-    try:
-        await bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=message_id,
-            text=text,
-            reply_markup=reply_markup
-        )
-        last_edit_time[key] = time.time()
-        return True
-    except Exception as e:
-        print(f"Error editing message: {e}")
-        return False
+def safe_edit_message(chat_id, message_id, text, reply_markup=None):
+    """Правка сообщения через общий планировщик правок: хендлер не ждет отправки,
+    а устаревшие правки того же сообщения отбрасываются"""
+    edit_coalescer.edit(chat_id, message_id, text, reply_markup=reply_markup, priority=PRIORITY_ADMIN)
 
 @router.message(Command("admin"))
 async def admin_panel(message: Message):
@@ -66,10 +45,10 @@ async def show_active_lobbies(callback: CallbackQuery):
         lobbies = db.get_all_lobbies()
         
         if not lobbies:
-            await callback.message.edit_text("<b>📭 Нет активных лобби!</b>")
+            safe_edit_message(callback.message.chat.id, callback.message.message_id, "<b>📭 Нет активных лобби!</b>")
             return
             
-        await safe_edit_message(
+        safe_edit_message(
             callback.message.chat.id,
             callback.message.message_id,
             "<b>🎯 Активные лобби 🎯</b>",
@@ -84,10 +63,10 @@ async def show_active_tournaments(callback: CallbackQuery):
         tournaments = db.get_all_tournaments()
         
         if not tournaments:
-            await callback.message.edit_text("<b>📭 Нет активных турниров!</b>")
+            safe_edit_message(callback.message.chat.id, callback.message.message_id, "<b>📭 Нет активных турниров!</b>")
             return
             
-        await safe_edit_message(
+        safe_edit_message(
             callback.message.chat.id,
             callback.message.message_id,
             "<b>🎯 Активные турниры 🎯</b>",
@@ -100,7 +79,7 @@ async def show_active_tournaments(callback: CallbackQuery):
 async def create_tournament_start(callback: CallbackQuery, state: FSMContext):
     await state.set_state(TournamentCreation.waiting_for_players)
     
-    await safe_edit_message(
+    safe_edit_message(
         callback.message.chat.id,
         callback.message.message_id,
         "<b>🎯 Создание турнира 🎯</b>\n\n"
@@ -174,22 +153,26 @@ async def process_registration_time(message: Message, state: FSMContext):
 async def show_lobby_info(callback: CallbackQuery):
     try:
         lobby_id = callback.data.split("_")[2]
-        lobby_data = db.get_lobby(lobby_id)
+        # Список мог устареть: завершенное лобби показываем из истории
+        lobby_data = db.get_lobby(lobby_id) or await db.get_history(lobby_id)
         
         if not lobby_data:
             await callback.answer("❌ Лобби не найдено!", show_alert=True)
             return
             
         info_text = f"<b>🎮 Лобби {lobby_id}</b>\n\n"
-        info_text += f"<code>Статус: {lobby_data['status']}</code>\n"
-        info_text += f"<code>Создано: {lobby_data['created_at'][:19].replace('T', ' ')}</code>\n\n"
+        info_text += f"<code>Статус: {lobby_data.status}</code>\n"
+        info_text += f"<code>Создано: {lobby_data.created_at[:19].replace('T', ' ')}</code>\n"
+        if lobby_data.finished:
+            info_text += f"<code>Победитель: {'@' + lobby_data.winner if lobby_data.winner else 'нет'}</code>\n"
+        info_text += "\n"
         
-        for username, player_data in lobby_data["players"].items():
-            status = "✅" if player_data["connected"] else "❌"
-            dice_status = "🎲" if player_data["dice"] else "⏳"
+        for username, player_data in lobby_data.players.items():
+            status = "✅" if player_data.connected else "❌"
+            dice_status = "🎲" if player_data.dice else "⏳"
             info_text += f"{status} {dice_status} @{username}\n"
         
-        await safe_edit_message(
+        safe_edit_message(
             callback.message.chat.id,
             callback.message.message_id,
             info_text
@@ -208,19 +191,19 @@ async def show_tournament_info(callback: CallbackQuery):
             return
             
         info_text = f"<b>🎯 Турнир {tournament_id}</b>\n\n"
-        info_text += f"<code>Статус: {tournament_data['status']}</code>\n"
-        info_text += f"<code>Игроков: {len(tournament_data['participants'])}/{tournament_data['max_players']}</code>\n"
-        info_text += f"<code>Время: {tournament_data['hours']} часов</code>\n"
-        info_text += f"<code>Создан: {tournament_data['created_at'][:19].replace('T', ' ')}</code>\n\n"
+        info_text += f"<code>Статус: {tournament_data.status}</code>\n"
+        info_text += f"<code>Игроков: {len(tournament_data.participants)}/{tournament_data.max_players}</code>\n"
+        info_text += f"<code>Время: {tournament_data.hours} часов</code>\n"
+        info_text += f"<code>Создан: {tournament_data.created_at[:19].replace('T', ' ')}</code>\n\n"
         
-        if tournament_data["participants"]:
-            info_text += f"<b>👥 Участники ({len(tournament_data['participants'])}):</b>\n"
-            for i, participant in enumerate(tournament_data["participants"][:10], 1):
+        if tournament_data.participants:
+            info_text += f"<b>👥 Участники ({len(tournament_data.participants)}):</b>\n"
+            for i, participant in enumerate(islice(tournament_data.participants, 10), 1):
                 info_text += f"{i}. @{participant}\n"
-            if len(tournament_data["participants"]) > 10:
-                info_text += f"... и еще {len(tournament_data['participants']) - 10}\n"
+            if len(tournament_data.participants) > 10:
+                info_text += f"... и еще {len(tournament_data.participants) - 10}\n"
         
-        await safe_edit_message(
+        safe_edit_message(
             callback.message.chat.id,
             callback.message.message_id,
             info_text
@@ -231,7 +214,7 @@ async def show_tournament_info(callback: CallbackQuery):
 @router.callback_query(F.data == "admin_back")
 async def back_to_admin_menu(callback: CallbackQuery, state: FSMContext):
     await state.clear()
-    await safe_edit_message(
+    safe_edit_message(
         callback.message.chat.id,
         callback.message.message_id,
         "<b>👑 Админ панель 👑</b>\n\n"
@@ -272,8 +255,8 @@ async def cleanup_database(message: Message):
         return
         
     try:
-        db.clear_old_data(7)
-        await message.answer("<b>✅ База данных очищена от старых записей (старше 7 дней)!</b>")
+        archived = await run_history_retention()
+        await message.answer(f"<b>✅ База данных очищена от старых записей (старше {HISTORY_RETENTION_DAYS} дней)!</b>\n\n<code>Перенесено в архив: {archived}</code>")
     except Exception as e:
         await message.answer(f"<b>❌ Ошибка при очистке базы данных: {e}</b>")
 
@@ -284,24 +267,22 @@ async def show_stats(message: Message):
         return
         
     try:
-        # Используем асинхронный доступ к данным
-        active_lobbies = len(db.get_all_lobbies())
-        tournaments = db.get_all_tournaments()
-        active_tournaments = len(tournaments)
-        
-        # Считаем историю лобби
-        data = db._read_data()
-        history_lobbies = len(data.get("history", {}))
+        # Счетчики ведет сама база, диск и обход данных не нужны
+        counters = db.get_counters()
+        lobbies_by_status = counters["lobbies_by_status"]
+        tournaments_by_status = counters["tournaments_by_status"]
+        active_tournaments = sum(tournaments_by_status.get(status, 0) for status in ("registration", "starting", "started"))
         
         stats_text = "<b>📊 Статистика системы</b>\n\n"
-        stats_text += f"<code>Активных лобби: {active_lobbies}</code>\n"
-        stats_text += f"<code>Завершенных игр: {history_lobbies}</code>\n"
+        stats_text += f"<code>Активных лобби: {counters['active_lobbies']}</code>\n"
+        stats_text += f"<code>  ожидают: {lobbies_by_status.get('waiting', 0)}, играют: {lobbies_by_status.get('playing', 0)}</code>\n"
+        stats_text += f"<code>Завершенных игр: {counters['finished_games']}</code>\n"
+        stats_text += f"<code>  ничьих: {counters['draws']}, по таймауту: {counters['timeouts']}</code>\n"
         stats_text += f"<code>Активных турниров: {active_tournaments}</code>\n\n"
         
         # Добавляем статистику по турнирам
-        if tournaments:
-            registered_players = sum(len(t['participants']) for t in tournaments.values())
-            stats_text += f"<code>Зарегистрировано игроков: {registered_players}</code>\n"
+        if counters["tournaments"]:
+            stats_text += f"<code>Зарегистрировано игроков: {counters['registered_players']}</code>\n"
         
         stats_text += "<blockquote>⚡ Система работает стабильно</blockquote>"
         
@@ -1,45 +1,51 @@
-import asyncio
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 
-from config import ADMIN_IDS, LOBBY_TIMEOUT, GAME_TIMEOUT
-from dependencies import get_bot, get_db
+from config import ADMIN_IDS, LOBBY_TIMEOUT, GAME_TIMEOUT, DICE_PENDING_TTL
+from dependencies import get_db, get_lobby_locks, get_outbox, get_scheduler
 from keyboards import get_connect_keyboard, get_game_result_keyboard
 from utils.helpers import format_game_result
+from outbox import PRIORITY_ADMIN
 
 router = Router()
 db = get_db()
-
-user_dice_throws = {}
+scheduler = get_scheduler()
+outbox = get_outbox()
+lobby_locks = get_lobby_locks()
 
 @router.message(Command("game"))
 async def create_game(message: Message):
+    chat_id = message.chat.id
     if message.from_user.id not in ADMIN_IDS:
-        await message.answer("<b>❌ Только админ может создавать игры !</b>")
+        outbox.send_message(chat_id, "<b>❌ Только админ может создавать игры !</b>")
         return
         
     try:
         parts = message.text.split()
         if len(parts) < 3:
-            await message.answer("<b>❌ Использование: /game @username1 @username2 !</b>")
+            outbox.send_message(chat_id, "<b>❌ Использование: /game @username1 @username2 !</b>")
             return
             
         username1 = parts[1].lstrip('@').lower()
         username2 = parts[2].lstrip('@').lower()
         
         if not username1 or not username2:
-            await message.answer("<b>❌ Указаны некорректные username !</b>")
+            outbox.send_message(chat_id, "<b>❌ Указаны некорректные username !</b>")
             return
             
         lobby_id = db.create_lobby(
-            message.chat.id,
+            chat_id,
             message.from_user.id,
             username1,
             username2
         )
         
-        await message.answer(
+        # Время на подключение считается с момента, когда объявление дойдет до чата
+        connect_timeout = LOBBY_TIMEOUT + outbox.expected_delay(chat_id)
+        
+        outbox.send_message(
+            chat_id,
             f"<b>✅ Успешно создано лобби 1 vs 1 ✅</b>\n\n"
             f"<code>🆔 ID: {lobby_id}</code>\n"
             f"<b>👤 Игрок 1: @{username1}</b>\n"
@@ -49,43 +55,41 @@ async def create_game(message: Message):
             reply_markup=get_connect_keyboard(lobby_id)
         )
         
-        asyncio.create_task(lobby_timeout(lobby_id))
+        scheduler.schedule(f"lobby_timeout:{lobby_id}", "lobby_timeout", connect_timeout, lobby_id=lobby_id)
         
     except Exception as e:
-        await message.answer(f"<b>❌ Ошибка при создании лобби: {e} !</b>")
+        outbox.send_message(chat_id, f"<b>❌ Ошибка при создании лобби: {e} !</b>")
 
 async def lobby_timeout(lobby_id: str):
     """Таймер для удаления лобби при неактивности"""
-    await asyncio.sleep(LOBBY_TIMEOUT)
-    
+    async with lobby_locks(lobby_id):
+        _lobby_timeout(lobby_id)
+
+def _lobby_timeout(lobby_id: str):
     lobby_data = db.get_lobby(lobby_id)
-    if lobby_data and lobby_data["status"] == "waiting":
+    if lobby_data and lobby_data.status == "waiting":
         # Находим кто не подключился
         not_connected = []
-        for username, player_data in lobby_data["players"].items():
-            if not player_data["connected"]:
+        for username, player_data in lobby_data.players.items():
+            if not player_data.connected:
                 not_connected.append(username)
         
         db.delete_lobby(lobby_id)
-        bot = get_bot()
         
         # Отправляем в чат
-        try:
-            if not_connected:
-                await bot.send_message(
-                    lobby_data["chat_id"],
-                    f"<b>❌ Лобби {lobby_id} удалено !</b>\n\n"
-                    f"<b>👥 Игроки: @{', @'.join(lobby_data['players'].keys())}</b>\n"
-                    f"<b>❌ Не подключились: @{', @'.join(not_connected)}</b>\n"
-                    f"<blockquote>⏰ Время на подключение истекло ! ⏰</blockquote>"
-                )
-            else:
-                await bot.send_message(
-                    lobby_data["chat_id"],
-                    f"<b>❌ Лобби {lobby_id} удалено по таймауту !</b>"
-                )
-        except:
-            pass
+        if not_connected:
+            outbox.send_message(
+                lobby_data.chat_id,
+                f"<b>❌ Лобби {lobby_id} удалено !</b>\n\n"
+                f"<b>👥 Игроки: @{', @'.join(lobby_data.players.keys())}</b>\n"
+                f"<b>❌ Не подключились: @{', @'.join(not_connected)}</b>\n"
+                f"<blockquote>⏰ Время на подключение истекло ! ⏰</blockquote>"
+            )
+        else:
+            outbox.send_message(
+                lobby_data.chat_id,
+                f"<b>❌ Лобби {lobby_id} удалено по таймауту !</b>"
+            )
 
 @router.callback_query(F.data.startswith("connect_"))
 async def connect_to_lobby(callback: CallbackQuery):
@@ -96,36 +100,34 @@ async def connect_to_lobby(callback: CallbackQuery):
         await callback.answer("<b>❌ У вас должен быть username !</b>", show_alert=True)
         return
         
+    async with lobby_locks(lobby_id):
+        await _connect_to_lobby(callback, lobby_id, username)
+
+async def _connect_to_lobby(callback: CallbackQuery, lobby_id: str, username: str):
     lobby_data = db.get_lobby(lobby_id)
     
     if not lobby_data:
         await callback.answer("<b>❌ Лобби не найдено или время истекло !</b>", show_alert=True)
         return
         
-    lobby_usernames = [name.lower() for name in lobby_data["players"].keys()]
-    if username not in lobby_usernames:
+    # Игрок может состоять и в других лобби чата, поэтому ищем его в самом лобби
+    original_username = next((name for name in lobby_data.players if name.lower() == username), None)
+    if not original_username:
         await callback.answer("<b>❌ Вы не участник этой игры !</b>", show_alert=True)
         return
-        
-    original_username = None
-    for player_username in lobby_data["players"].keys():
-        if player_username.lower() == username:
-            original_username = player_username
-            break
             
     if db.connect_player(lobby_id, original_username):
         await callback.answer("<b>✅ Вы подключились к лобби !</b>")
         
         lobby_data = db.get_lobby(lobby_id)
-        all_connected = all(player["connected"] for player in lobby_data["players"].values())
+        all_connected = all(player.connected for player in lobby_data.players.values())
         
         if all_connected:
             db.update_lobby_status(lobby_id, "playing")
-            players = list(lobby_data["players"].keys())
+            players = list(lobby_data.players.keys())
             
-            bot = get_bot()
-            await bot.send_message(
-                lobby_data["chat_id"],
+            outbox.send_message(
+                lobby_data.chat_id,
                 f"<b>🎮 Все игроки подключились к лобби {lobby_id} ! 🎮</b>\n\n"
                 f"<b>👤 @{players[0]} и 👤 @{players[1]}</b>\n\n"
                 f"<b>🎲 Кидайте по 2 кубика в этот чат !</b>\n"
@@ -135,39 +137,45 @@ async def connect_to_lobby(callback: CallbackQuery):
             )
             
             # ЗАПУСКАЕМ ТАЙМЕР ДЛЯ ИГРЫ
-            asyncio.create_task(game_timeout(lobby_id))
+            scheduler.cancel(f"lobby_timeout:{lobby_id}")
+            scheduler.schedule(f"game_timeout:{lobby_id}", "game_timeout", GAME_TIMEOUT, lobby_id=lobby_id)
             
     else:
         await callback.answer("<b>❌ Ошибка подключения !</b>", show_alert=True)
 
 async def game_timeout(lobby_id: str):
     """Таймер для автоматического завершения игры"""
-    await asyncio.sleep(GAME_TIMEOUT)
+    async with lobby_locks(lobby_id):
+        await _game_timeout(lobby_id)
+
+async def _game_timeout(lobby_id: str):
+    lobby_data = db.get_lobby(lobby_id)
     
-    from dependencies import get_bot, get_db
-    bot = get_bot()
-    db = get_db()
+    # Турнирное лобби, в которое не все подключились, тоже завершается:
+    # иначе оно навсегда остановит сетку
+    waiting_in_tournament = lobby_data and lobby_data.status == "waiting" and lobby_data.tournament_id
     
-    lobby_data = db.get_lobby(lobby_id)
-    if lobby_data and lobby_data["status"] == "playing":
+    if lobby_data and (lobby_data.status == "playing" or waiting_in_tournament):
         
-        players = list(lobby_data["players"].keys())
+        players = list(lobby_data.players.keys())
         scores = {}
         losers = []
         
         for player in players:
-            dice_values = lobby_data["players"][player]["dice"]
+            dice_values = lobby_data.players[player].dice
             if dice_values and len(dice_values) == 2:
                 scores[player] = sum(dice_values)
             else:
                 scores[player] = 0
-                losers.append(player)
+                # До начала игры проигрывает только тот, кто не подключился
+                if not waiting_in_tournament or not lobby_data.players[player].connected:
+                    losers.append(player)
         
         # Если оба не бросили - оба проиграли
         if len(losers) == 2:
             db.update_lobby_status(lobby_id, "timeout", None, scores)
-            await bot.send_message(
-                lobby_data["chat_id"],
+            outbox.send_message(
+                lobby_data.chat_id,
                 f"<b>⏰ Время вышло ! ⏰</b>\n\n"
                 f"<b>❌ Оба игрока не бросили кубики !</b>\n"
                 f"<b>👤 @{players[0]} и 👤 @{players[1]} - проиграли по таймауту !</b>\n"
@@ -175,23 +183,21 @@ async def game_timeout(lobby_id: str):
             )
             
             # Отправляем админу
-            try:
-                await bot.send_message(
-                    lobby_data["admin_id"],
-                    f"<b>⏰ ЛОББИ {lobby_id} - ТАЙМАУТ ⏰</b>\n\n"
-                    f"<b>👥 Игроки: @{', @'.join(players)}</b>\n"
-                    f"<b>❌ Оба не бросили кубики</b>\n"
-                    f"<blockquote>🕐 Время на броски истекло</blockquote>"
-                )
-            except:
-                pass
+            outbox.send_message(
+                lobby_data.admin_id,
+                f"<b>⏰ ЛОББИ {lobby_id} - ТАЙМАУТ ⏰</b>\n\n"
+                f"<b>👥 Игроки: @{', @'.join(players)}</b>\n"
+                f"<b>❌ Оба не бросили кубики</b>\n"
+                f"<blockquote>🕐 Время на броски истекло</blockquote>",
+                priority=PRIORITY_ADMIN
+            )
                 
         # Если один не бросил - он проиграл
         elif len(losers) == 1:
             winner = [p for p in players if p not in losers][0]
             db.update_lobby_status(lobby_id, "finished", winner, scores)
-            await bot.send_message(
-                lobby_data["chat_id"],
+            outbox.send_message(
+                lobby_data.chat_id,
                 f"<b>⏰ Время вышло ! ⏰</b>\n\n"
                 f"<b>❌ @{losers[0]} не бросил кубики !</b>\n"
                 f"<b>🏆 Победитель: @{winner} по таймауту !</b>\n"
@@ -199,21 +205,19 @@ async def game_timeout(lobby_id: str):
             )
             
             # Отправляем админу
-            try:
-                await bot.send_message(
-                    lobby_data["admin_id"],
-                    f"<b>🏆 ПОБЕДИТЕЛЬ ЛОББИ {lobby_id} 🏆</b>\n\n"
-                    f"<b>👥 Игроки: @{', @'.join(players)}</b>\n"
-                    f"<b>🎯 Победитель: @{winner}</b>\n"
-                    f"<b>📊 Причина: противник не бросил кубики</b>\n"
-                    f"<blockquote>⚡ Информация о завершенной игре ⚡</blockquote>"
-                )
-            except:
-                pass
+            outbox.send_message(
+                lobby_data.admin_id,
+                f"<b>🏆 ПОБЕДИТЕЛЬ ЛОББИ {lobby_id} 🏆</b>\n\n"
+                f"<b>👥 Игроки: @{', @'.join(players)}</b>\n"
+                f"<b>🎯 Победитель: @{winner}</b>\n"
+                f"<b>📊 Причина: противник не бросил кубики</b>\n"
+                f"<blockquote>⚡ Информация о завершенной игре ⚡</blockquote>",
+                priority=PRIORITY_ADMIN
+            )
                 
         else:
             # Оба бросили - обрабатываем результаты
-            await process_game_result(lobby_id, lobby_data["chat_id"], force=True)
+            await _process_game_result(lobby_id, lobby_data.chat_id, force=True)
         
         # Перемещаем в историю
         db.move_to_history(lobby_id)
@@ -224,51 +228,43 @@ async def handle_dice_throw(message: Message):
     if not username:
         return
         
-    lobbies = db.get_all_lobbies()
-    for lobby_id, lobby_data in lobbies.items():
-        lobby_usernames = [name.lower() for name in lobby_data["players"].keys()]
+    player_lobby = db.find_player_lobby(message.chat.id, username)
+    if not player_lobby:
+        return
         
-        if (lobby_data["chat_id"] == message.chat.id and 
-            lobby_data["status"] == "playing" and 
-            username in lobby_usernames):
-            
-            original_username = None
-            for player_username in lobby_data["players"].keys():
-                if player_username.lower() == username:
-                    original_username = player_username
-                    break
-            
-            if original_username not in user_dice_throws:
-                user_dice_throws[original_username] = []
-            
-            user_dice_throws[original_username].append(message.dice.value)
-            
-            if len(user_dice_throws[original_username]) == 2:
-                db.set_player_dice(lobby_id, original_username, user_dice_throws[original_username].copy())
-                del user_dice_throws[original_username]
-                
-                await message.answer(f"<b>✅ @{original_username} бросил кубики !</b>")
-                
-                lobby_data = db.get_lobby(lobby_id)
-                all_thrown = all(player["dice"] is not None for player in lobby_data["players"].values())
-                
-                if all_thrown:
-                    await process_game_result(lobby_id, message.chat.id)
-            break
+    lobby_id, original_username = player_lobby
+    async with lobby_locks(lobby_id):
+        await _handle_dice_throw(message, lobby_id, original_username)
 
-async def process_game_result(lobby_id: str, chat_id: int, force: bool = False):
-    bot = get_bot()
-    db = get_db()
+async def _handle_dice_throw(message: Message, lobby_id: str, original_username: str):
+    lobby_data = db.get_lobby(lobby_id)
+    # Пока ждали очереди, лобби могло закончиться
+    if not lobby_data or lobby_data.status != "playing":
+        return
+            
+    # Первый кубик ждет второй в состоянии лобби
+    dice_values = db.add_player_throw(lobby_id, original_username, message.dice.value, DICE_PENDING_TTL)
     
+    if dice_values:
+        outbox.send_message(message.chat.id, f"<b>✅ @{original_username} бросил кубики !</b>")
+        
+        lobby_data = db.get_lobby(lobby_id)
+        all_thrown = all(player.dice is not None for player in lobby_data.players.values())
+        
+        if all_thrown:
+            await _process_game_result(lobby_id, message.chat.id)
+
+async def _process_game_result(lobby_id: str, chat_id: int, force: bool = False):
+    """Подведение итогов; вызывающий уже держит блокировку лобби"""
     lobby_data = db.get_lobby(lobby_id)
     if not lobby_data:
         return
         
-    players = list(lobby_data["players"].keys())
+    players = list(lobby_data.players.keys())
     
     scores = {}
     for player in players:
-        dice_values = lobby_data["players"][player]["dice"]
+        dice_values = lobby_data.players[player].dice
         if dice_values and len(dice_values) == 2:
             scores[player] = sum(dice_values)
         else:
@@ -282,37 +278,33 @@ async def process_game_result(lobby_id: str, chat_id: int, force: bool = False):
         winner = player1
         db.update_lobby_status(lobby_id, "finished", winner, scores)
         result_text = format_game_result(db.get_lobby(lobby_id))
-        await bot.send_message(chat_id, result_text, reply_markup=get_game_result_keyboard())
+        outbox.send_message(chat_id, result_text, reply_markup=get_game_result_keyboard())
         
-        try:
-            await bot.send_message(
-                lobby_data["admin_id"],
-                f"<b>🏆 ПОБЕДИТЕЛЬ ЛОББИ {lobby_id} 🏆</b>\n\n"
-                f"<b>👥 Игроки: @{player1} vs @{player2}</b>\n"
-                f"<b>📊 Счет: {score1} - {score2}</b>\n"
-                f"<b>🎯 Победитель: @{winner}</b>\n"
-                f"<blockquote>⚡ Информация о завершенной игре ⚡</blockquote>"
-            )
-        except:
-            pass
+        outbox.send_message(
+            lobby_data.admin_id,
+            f"<b>🏆 ПОБЕДИТЕЛЬ ЛОББИ {lobby_id} 🏆</b>\n\n"
+            f"<b>👥 Игроки: @{player1} vs @{player2}</b>\n"
+            f"<b>📊 Счет: {score1} - {score2}</b>\n"
+            f"<b>🎯 Победитель: @{winner}</b>\n"
+            f"<blockquote>⚡ Информация о завершенной игре ⚡</blockquote>",
+            priority=PRIORITY_ADMIN
+        )
             
     elif score2 > score1:
         winner = player2
         db.update_lobby_status(lobby_id, "finished", winner, scores)
         result_text = format_game_result(db.get_lobby(lobby_id))
-        await bot.send_message(chat_id, result_text, reply_markup=get_game_result_keyboard())
+        outbox.send_message(chat_id, result_text, reply_markup=get_game_result_keyboard())
         
-        try:
-            await bot.send_message(
-                lobby_data["admin_id"],
-                f"<b>🏆 ПОБЕДИТЕЛЬ ЛОББИ {lobby_id} 🏆</b>\n\n"
-                f"<b>👥 Игроки: @{player1} vs @{player2}</b>\n"
-                f"<b>📊 Счет: {score1} - {score2}</b>\n"
-                f"<b>🎯 Победитель: @{winner}</b>\n"
-                f"<blockquote>⚡ Информация о завершенной игре ⚡</blockquote>"
-            )
-        except:
-            pass
+        outbox.send_message(
+            lobby_data.admin_id,
+            f"<b>🏆 ПОБЕДИТЕЛЬ ЛОББИ {lobby_id} 🏆</b>\n\n"
+            f"<b>👥 Игроки: @{player1} vs @{player2}</b>\n"
+            f"<b>📊 Счет: {score1} - {score2}</b>\n"
+            f"<b>🎯 Победитель: @{winner}</b>\n"
+            f"<blockquote>⚡ Информация о завершенной игре ⚡</blockquote>",
+            priority=PRIORITY_ADMIN
+        )
             
     else:
         # НИЧЬЯ - ПЕРЕКИДЫВАЕМ, А НЕ ЗАВЕРШАЕМ
@@ -322,29 +314,22 @@ async def process_game_result(lobby_id: str, chat_id: int, force: bool = False):
         else:
             db.update_lobby_status(lobby_id, "draw", None, scores)
             result_text = format_game_result(db.get_lobby(lobby_id))
-            await bot.send_message(chat_id, result_text, reply_markup=get_game_result_keyboard())
+            outbox.send_message(chat_id, result_text, reply_markup=get_game_result_keyboard())
     
     # Перемещаем в историю только если игра завершена (не ничья для переброса)
     db.move_to_history(lobby_id)
+    scheduler.cancel(f"game_timeout:{lobby_id}")
 
 async def handle_draw(lobby_id: str, chat_id: int, players: list):
     """Обработка ничьи - переброс кубиков"""
-    bot = get_bot()
-    db = get_db()
-    
-    # Сбрасываем броски для перекидывания
+    # Сбрасываем броски для перекидывания (вместе с недокинутыми кубиками)
     for player in players:
         db.set_player_dice(lobby_id, player, None)
     
-    # Очищаем временные данные
-    for player in players:
-        if player in user_dice_throws:
-            del user_dice_throws[player]
-    
     # НЕ перемещаем в историю! Оставляем лобби активным
     db.update_lobby_status(lobby_id, "playing")  # Возвращаем статус playing
     
-    await bot.send_message(
+    outbox.send_message(
         chat_id,
         f"<b>🎯 НИЧЬЯ ! 🎯</b>\n\n"
         f"<b>👤 @{players[0]} и 👤 @{players[1]}</b>\n\n"
@@ -354,66 +339,16 @@ async def handle_draw(lobby_id: str, chat_id: int, players: list):
         f"<blockquote>⚡ На этот раз определим победителя ! ⚡</blockquote>"
     )
     
-    # Запускаем таймер заново
-    asyncio.create_task(game_timeout(lobby_id))
+    # Перезапускаем таймер: старый дедлайн заменяется, а не добавляется второй
+    scheduler.reschedule(f"game_timeout:{lobby_id}", "game_timeout", GAME_TIMEOUT, lobby_id=lobby_id)
 
-async def create_lobby_from_tournament(tournament_id: str, participants: list) -> list:
-    """Создание лобби из участников турнира"""
-    from dependencies import get_bot, get_db
-    bot = get_bot()
-    db = get_db()
-    
-    # Получаем данные турнира
-    tournament_data = None
-    all_tournaments = db.get_all_tournaments()
-    for tid, data in all_tournaments.items():
-        if tid == tournament_id:
-            tournament_data = data
-            break
-    
-    if not tournament_data:
-        return []
-    
-    lobbies = []
-    # Разбиваем участников на пары
-    for i in range(0, len(participants), 2):
-        if i + 1 < len(participants):
-            username1 = participants[i]
-            username2 = participants[i + 1]
-            
-            # Создаем лобби
-            lobby_id = db.create_lobby(
-                tournament_data["chat_id"],
-                tournament_data["admin_id"],
-                username1,
-                username2
-            )
-            
-            lobbies.append(lobby_id)
-            
-            # Отправляем сообщение о создании лобби в ЧАТ
-            await bot.send_message(
-                tournament_data["chat_id"],
-                f"<b>🎮 ТУРНИРНОЕ ЛОББИ СОЗДАНО ! 🎮</b>\n\n"
-                f"<code>🆔 ID: {lobby_id}</code>\n\n"
-                f"<b>👤 @{username1} vs 👤 @{username2}</b>\n\n"
-                f"<b>🎲 Игра: Кубы PvP</b>\n\n"
-                f"<b>⏰ Время на броски: 5 минут !</b>\n"
-                f"<b>❌ Если не бросите - автоматическое поражение !</b>\n\n"
-                f"<blockquote>⚡ Удачи в турнире ! ⚡</blockquote>",
-                reply_markup=get_connect_keyboard(lobby_id)
-            )
-            
-            # ЗАПУСКАЕМ ТАЙМЕР ДЛЯ ЛОББИ - ВАЖНО!
-            asyncio.create_task(game_timeout(lobby_id))
-    
-    return lobbies
+scheduler.register("lobby_timeout", lobby_timeout)
+scheduler.register("game_timeout", game_timeout)
 
 @router.message(Command("cancel"))
 async def cancel_game(message: Message):
     if message.from_user.id not in ADMIN_IDS:
         return
         
-    global user_dice_throws
-    user_dice_throws = {}
+    db.clear_pending_throws()
     await message.answer("<b>✅ Временные данные очищены !</b>")
\ No newline at end of file
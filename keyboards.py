@@ -1,8 +1,10 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from profiling import traced
 
 
 
+@traced("format")
 def get_connect_keyboard(lobby_id: str) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(
@@ -14,6 +16,7 @@ def get_connect_keyboard(lobby_id: str) -> InlineKeyboardMarkup:
 
 
 
+@traced("format")
 def get_tournament_join_keyboard(tournament_id: str) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(
@@ -25,6 +28,7 @@ def get_tournament_join_keyboard(tournament_id: str) -> InlineKeyboardMarkup:
 
 
 
+@traced("format")
 def get_game_result_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     
@@ -44,6 +48,7 @@ def get_game_result_keyboard() -> InlineKeyboardMarkup:
 
 
 
+@traced("format")
 def get_game_result_chat() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     
@@ -58,6 +63,7 @@ def get_game_result_chat() -> InlineKeyboardMarkup:
 
 
 
+@traced("format")
 def get_admin_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
 
@@ -71,13 +77,14 @@ def get_admin_keyboard() -> InlineKeyboardMarkup:
 
 
 
+@traced("format")
 def get_lobby_list_keyboard(lobbies: dict) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
 
     for lobby_id, lobby_data in lobbies.items():
-        status_emoji = "🟢" if lobby_data['status'] == 'playing' else "🟡" if lobby_data['status'] == 'waiting' else "🔴"
+        status_emoji = "🟢" if lobby_data.status == 'playing' else "🟡" if lobby_data.status == 'waiting' else "🔴"
         builder.button(
-            text=f"{status_emoji} Лобби {lobby_id} - {lobby_data['status']} {status_emoji}", 
+            text=f"{status_emoji} Лобби {lobby_id} - {lobby_data.status} {status_emoji}", 
             callback_data=f"lobby_info_{lobby_id}"
         )
 
@@ -91,13 +98,14 @@ def get_lobby_list_keyboard(lobbies: dict) -> InlineKeyboardMarkup:
 
 
 
+@traced("format")
 def get_tournament_list_keyboard(tournaments: dict) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
 
     for tournament_id, tournament_data in tournaments.items():
-        status_emoji = "🟢" if tournament_data['status'] == 'started' else "🟡" if tournament_data['status'] == 'registration' else "🔴"
+        status_emoji = "🟢" if tournament_data.status == 'started' else "🟡" if tournament_data.status == 'registration' else "🔴"
         builder.button(
-            text=f"{status_emoji} Турнир {tournament_id} - {tournament_data['status']} {status_emoji}", 
+            text=f"{status_emoji} Турнир {tournament_id} - {tournament_data.status} {status_emoji}", 
             callback_data=f"tournament_info_{tournament_id}"
         )
 
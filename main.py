@@ -1,23 +1,79 @@
 # main.py
 import asyncio
+import logging
+import signal
+from typing import Any, Dict, Optional, Set
+from aiohttp import web
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.base import BaseSession
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import TelegramMethod
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
-from config import BOT_TOKEN
+from config import (
+    BOT_TOKEN, BOT_MODE, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SHUTDOWN_TIMEOUT,
+    METRICS_ENABLED, METRICS_HOST, METRICS_PORT,
+    FSM_STORAGE_PATH, FSM_STATE_TTL, FSM_FLUSH_INTERVAL, FSM_MAX_SESSIONS,
+    PROFILING_ENABLED, PROFILING_SLOW_THRESHOLD, PROFILING_SAMPLE_RATE, PROFILING_DIR, PROFILING_KEEP
+)
 from handlers import admin, game, common, tournament
-from dependencies import set_bot_instance
-from middleware import AccessMiddleware, RateLimitMiddleware
+from dependencies import set_bot_instance, get_db, get_outbox, get_scheduler, get_edit_coalescer
+from middleware import (
+    AccessMiddleware, RateLimitMiddleware, HandlerTimingMiddleware, TelegramApiMetricsMiddleware, ProfilingMiddleware
+)
+import metrics
+from profiling import ProfileStore
+from storage.fsm import SqliteFSMStorage
+from services.retention import ensure_retention_job
 
-async def main():
-    storage = MemoryStorage()
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+logger = logging.getLogger(__name__)
+
+async def on_startup():
+    db = get_db()
+    await db.open()
+    await db.start_background_writer()
+    await get_scheduler().start()
+    ensure_retention_job()
+    await get_outbox().start()
+    if METRICS_ENABLED:
+        await metrics.start_server(METRICS_HOST, METRICS_PORT)
+
+async def on_shutdown():
+    await metrics.stop_server()
+    await get_scheduler().stop()
+    # Успеваем отправить то, что уже стоит в очереди, вместе с отложенными правками
+    get_edit_coalescer().flush()
+    await get_outbox().stop()
+    # Дописываем все накопленные изменения перед выходом
+    await get_db().close()
+
+def build_bot(session: Optional[BaseSession] = None) -> Bot:
+    bot = Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    bot.session.middleware(TelegramApiMetricsMiddleware())
+    set_bot_instance(bot)
+    return bot
+
+def build_dispatcher() -> Dispatcher:
+    # Мастер создания турнира переживает перезапуск; хранилище закрывает сам диспетчер
+    storage = SqliteFSMStorage(
+        FSM_STORAGE_PATH, ttl=FSM_STATE_TTL, flush_interval=FSM_FLUSH_INTERVAL, max_sessions=FSM_MAX_SESSIONS
+    )
     dp = Dispatcher(storage=storage)
     
-    set_bot_instance(bot)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
     
     # Middleware
+    if PROFILING_ENABLED:
+        # Первым, чтобы в замер попали и проверки доступа и частоты
+        profiling_middleware = ProfilingMiddleware(
+            ProfileStore(PROFILING_DIR, PROFILING_KEEP), PROFILING_SLOW_THRESHOLD, PROFILING_SAMPLE_RATE
+        )
+        dp.message.middleware(profiling_middleware)
+        dp.callback_query.middleware(profiling_middleware)
+        
     access_middleware = AccessMiddleware()
     rate_limit_middleware = RateLimitMiddleware()
     
@@ -27,12 +83,96 @@ async def main():
     dp.callback_query.middleware(rate_limit_middleware)
     
     # Routers
-    dp.include_router(common.router)
-    dp.include_router(admin.router)
-    dp.include_router(game.router)
-    dp.include_router(tournament.router)
+    routers = {"common": common.router, "admin": admin.router, "game": game.router, "tournament": tournament.router}
+    for name, router in routers.items():
+        timing_middleware = HandlerTimingMiddleware(name)
+        router.message.middleware(timing_middleware)
+        router.callback_query.middleware(timing_middleware)
+        dp.include_router(router)
+    
+    return dp
+
+class BackgroundRequestHandler(SimpleRequestHandler):
+    """Вебхук, который сразу отвечает Telegram, а обновление обрабатывает в фоне.
+    Задачи обработки хранятся здесь же, чтобы при остановке их дождаться"""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: Optional[str] = None, **data: Any):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=False, secret_token=secret_token, **data)
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        bot = await self.resolve_bot(request)
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), bot):
+            return web.Response(body="Unauthorized", status=401)
+        
+        update = await request.json(loads=bot.session.json_loads)
+        task = asyncio.create_task(self._feed_update(bot, update))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def _feed_update(self, bot: Bot, update: Dict[str, Any]):
+        result = await self.dispatcher.feed_raw_update(bot=bot, update=update, **self.data)
+        # Ответ методом в теле вебхука уже невозможен: выполняем его запросом
+        if isinstance(result, TelegramMethod):
+            await self.dispatcher.silent_call_request(bot=bot, result=result)
+
+def build_webhook_app(dp: Dispatcher, bot: Bot, secret_token: str = WEBHOOK_SECRET, path: str = WEBHOOK_PATH) -> web.Application:
+    """aiohttp-приложение, принимающее обновления от Telegram.
+    Его же можно поднять в тестах и слать обновления локальным POST-запросом"""
+    app = web.Application()
+    handler = BackgroundRequestHandler(dispatcher=dp, bot=bot, secret_token=secret_token)
+    
+    async def wait_for_updates(_: web.Application):
+        # Обновления обрабатываются в фоне: даем дообработать принятые
+        tasks = handler.tasks
+        if tasks:
+            logger.info(f"Дообрабатываем {len(tasks)} обновлений перед остановкой")
+            await asyncio.wait(set(tasks), timeout=WEBHOOK_SHUTDOWN_TIMEOUT)
+    
+    # Порядок остановки: принятые обновления -> shutdown диспетчера -> сессия бота
+    app.on_shutdown.append(wait_for_updates)
+    setup_application(app, dp, bot=bot)
+    handler.register(app, path=path)
+    return app
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    await bot.set_webhook(
+        WEBHOOK_BASE_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    
+    runner = web.AppRunner(build_webhook_app(dp, bot))
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Webhook слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    
+    try:
+        await stop_event.wait()
+    finally:
+        # Сначала перестаем принимать запросы, затем срабатывает on_shutdown
+        await runner.cleanup()
+
+async def main():
+    bot = build_bot()
+    dp = build_dispatcher()
     
-    await dp.start_polling(bot)
+    if BOT_MODE == "webhook":
+        await run_webhook(dp, bot)
+    else:
+        # Оставшийся вебхук не дает работать getUpdates
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
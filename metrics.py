@@ -0,0 +1,197 @@
+# metrics.py
+import bisect
+import logging
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Метрики в текстовом формате Prometheus без внешних зависимостей
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self) -> float:
+        """Сумма по всем значениям меток"""
+        return sum(self._values.values())
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Значение читается функцией в момент запроса: число или {значения меток: число}"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, read: Callable, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._read = read
+
+    def samples(self) -> List[str]:
+        value = self._read()
+        if not self.labelnames:
+            return [f"{self.name} {value}"]
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key if isinstance(key, tuple) else (key,))} {v}"
+            for key, v in value.items()
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # метки -> [счетчики по корзинам (не накопительные), сумма, количество]
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                le_label = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                logger.error(f"Ошибка сбора метрики {metric.name}: {e}")
+                continue
+            lines.extend(metric.header())
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+handler_seconds = REGISTRY.register(Histogram(
+    "tourbot_handler_seconds", "Время обработки апдейта хендлером", ("router", "event")
+))
+telegram_api_seconds = REGISTRY.register(Histogram(
+    "tourbot_telegram_api_seconds", "Время запроса к Telegram Bot API", ("method",)
+))
+telegram_api_errors = REGISTRY.register(Counter(
+    "tourbot_telegram_api_errors_total", "Ошибки запросов к Telegram Bot API", ("method", "error")
+))
+db_flush_seconds = REGISTRY.register(Histogram(
+    "tourbot_db_flush_seconds", "Время записи пачки изменений на диск"
+))
+rate_limit_rejections = REGISTRY.register(Counter(
+    "tourbot_rate_limit_rejections_total", "Апдейты, отклоненные ограничителем частоты", ("limit",)
+))
+
+
+def register_state_gauges(db, scheduler, outbox):
+    """Показатели состояния, которые читаются при каждом запросе /metrics"""
+    REGISTRY.register(Gauge(
+        "tourbot_active_lobbies", "Активные лобби по статусу",
+        lambda: db.get_counters()["lobbies_by_status"], ("status",)
+    ))
+    REGISTRY.register(Gauge(
+        "tourbot_tournaments", "Турниры по статусу",
+        lambda: db.get_counters()["tournaments_by_status"], ("status",)
+    ))
+    REGISTRY.register(Gauge(
+        "tourbot_pending_timers", "Таймеры, ожидающие срабатывания", scheduler.pending_count
+    ))
+    REGISTRY.register(Gauge(
+        "tourbot_db_pending_writes", "Изменения, ожидающие записи на диск",
+        lambda: db.get_writer_stats()["pending"]
+    ))
+    REGISTRY.register(Gauge(
+        "tourbot_outbox_pending", "Исходящие сообщения в очереди", outbox.pending_count
+    ))
+
+
+_runner: Optional[web.AppRunner] = None
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_server(host: str, port: int):
+    """Локальный HTTP-сервер с /metrics"""
+    global _runner
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    _runner = web.AppRunner(app)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+
+
+async def stop_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
\ No newline at end of file
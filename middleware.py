@@ -1,9 +1,20 @@
 # middleware.py
-from aiogram import BaseMiddleware
+import asyncio
+import cProfile
+import logging
+import random
+import time
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod, Response
 from aiogram.types import Message, CallbackQuery
 from typing import Callable, Dict, Any, Awaitable
 from config import ALLOWED_CHAT_ID, ADMIN_IDS
 from dependencies import get_cache
+import metrics
+import profiling
+
+logger = logging.getLogger(__name__)
 
 class AccessMiddleware(BaseMiddleware):
     async def __call__(
@@ -40,18 +51,123 @@ class RateLimitMiddleware(BaseMiddleware):
         
         if isinstance(event, (Message, CallbackQuery)):
             user_id = event.from_user.id
-            key = f"rate_limit_{user_id}"
+            checks = [(f"rate_limit_{user_id}", 5, 60)]  # 5 запросов в минуту
             
-            if not cache.check_rate_limit(key, 5, 60):  # 5 запросов в минуту
+            # Additional spam protection for dice throws
+            is_dice = isinstance(event, Message) and event.dice
+            if is_dice:
+                checks.append((f"dice_limit_{user_id}", 3, 10))  # 3 кубика в 10 секунд
+                
+            rejected = cache.check_rate_limits(checks)
+            if rejected is not None:
+                metrics.rate_limit_rejections.inc(limit="dice" if rejected.startswith("dice_limit_") else "global")
                 if isinstance(event, CallbackQuery):
                     await event.answer("⚠️ Слишком много запросов! Подождите немного.", show_alert=True)
-                return
-            
-            # Additional spam protection for dice throws
-            if isinstance(event, Message) and event.dice:
-                dice_key = f"dice_limit_{user_id}"
-                if not cache.check_rate_limit(dice_key, 3, 10):  # 3 кубика в 10 секунд
+                elif is_dice and rejected.startswith("dice_limit_"):
                     await event.answer("⚠️ Слишком много бросков! Подождите 10 секунд.")
-                    return
+                return
+        
+        return await handler(event, data)
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Время работы хендлеров одного роутера"""
+    
+    def __init__(self, router_name: str):
+        self.router_name = router_name
+        
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message | CallbackQuery,
+        data: Dict[str, Any]
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            metrics.handler_seconds.observe(
+                time.perf_counter() - started,
+                router=self.router_name,
+                event="callback_query" if isinstance(event, CallbackQuery) else "message"
+            )
+
+class TelegramApiMetricsMiddleware(BaseRequestMiddleware):
+    """Время и ошибки запросов к Bot API"""
+    
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod
+    ) -> Response:
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            metrics.telegram_api_errors.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.telegram_api_seconds.observe(elapsed, method=name)
+            profiling.record("api", elapsed)
+
+class ProfilingMiddleware(BaseMiddleware):
+    """Трассировка апдейтов: время по сегментам db/api/format и отчеты о медленных.
+    
+    Каждый апдейт трассируется; доля sample_rate выполняется под cProfile.
+    Если апдейт дольше slow_threshold, отчет пишется в ProfileStore.
+    cProfile видит весь поток, поэтому в профиль попадают и задачи,
+    которые выполнялись, пока хендлер ждал, - одновременно идет только один."""
+    
+    _profiling = False
+    
+    def __init__(self, store: profiling.ProfileStore, slow_threshold: float, sample_rate: float):
+        self.store = store
+        self.slow_threshold = slow_threshold
+        self.sample_rate = sample_rate
         
-        return await handler(event, data)
\ No newline at end of file
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message | CallbackQuery,
+        data: Dict[str, Any]
+    ) -> Any:
+        token = profiling.start_trace()
+        profile = None
+        if not ProfilingMiddleware._profiling and random.random() < self.sample_rate:
+            ProfilingMiddleware._profiling = True
+            profile = cProfile.Profile()
+            profile.enable()
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            if profile is not None:
+                profile.disable()
+                ProfilingMiddleware._profiling = False
+            trace = profiling.current_trace()
+            profiling.finish_trace(token)
+            if elapsed >= self.slow_threshold:
+                await self._report_slow(event, data, elapsed, trace, profile)
+                
+    async def _report_slow(self, event, data: Dict[str, Any], elapsed: float, trace: profiling.UpdateTrace, profile):
+        handler_object = data.get("handler")
+        update = data.get("event_update")
+        segments = {name: round(value, 6) for name, value in trace.segments.items()}
+        segments["other"] = round(max(elapsed - sum(trace.segments.values()), 0.0), 6)
+        report = {
+            "update_id": update.update_id if update else None,
+            "event": "callback_query" if isinstance(event, CallbackQuery) else "message",
+            "handler": getattr(getattr(handler_object, "callback", None), "__qualname__", None),
+            "user_id": event.from_user.id if event.from_user else None,
+            "elapsed": round(elapsed, 6),
+            "segments": segments,
+            "calls": dict(trace.calls)
+        }
+        logger.warning(f"Медленный апдейт {report['handler']}: {elapsed:.3f} с, сегменты {segments}")
+        try:
+            await asyncio.to_thread(self.store.write, report, profile)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить отчет о медленном апдейте: {e}")
\ No newline at end of file
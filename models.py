@@ -0,0 +1,175 @@
+# models.py
+import copy
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from storage.journal import history_finished_at
+
+# Модели живут только в памяти; в хранилище и обратно идут через to_dict/from_dict
+
+@dataclass(slots=True)
+class PlayerSlot:
+    """Место игрока в лобби"""
+    connected: bool = False
+    dice: Optional[List[int]] = None
+    pending: Optional[List[int]] = None  # первый кубик: [значение, время]
+
+    def to_dict(self) -> Dict:
+        data = {"connected": self.connected, "dice": list(self.dice) if self.dice is not None else None}
+        if self.pending is not None:
+            data["pending"] = list(self.pending)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "PlayerSlot":
+        return cls(data.get("connected", False), data.get("dice"), data.get("pending"))
+
+@dataclass(slots=True)
+class Lobby:
+    """Активное лобби на двух игроков"""
+    lobby_id: str
+    chat_id: int
+    admin_id: int
+    players: Dict[str, PlayerSlot]
+    created_at: str
+    status: str = "waiting"
+    winner: Optional[str] = None
+    scores: Optional[Dict[str, int]] = None
+    finished: bool = False
+    tournament_id: Optional[str] = None
+    bracket_node: Optional[int] = None
+
+    def to_dict(self) -> Dict:
+        data = {
+            "lobby_id": self.lobby_id,
+            "chat_id": self.chat_id,
+            "admin_id": self.admin_id,
+            "players": {username: player.to_dict() for username, player in self.players.items()},
+            "created_at": self.created_at,
+            "status": self.status,
+            "winner": self.winner,
+            "scores": dict(self.scores) if self.scores is not None else None,
+            "finished": self.finished,
+            "tournament_id": self.tournament_id
+        }
+        if self.bracket_node is not None:
+            data["bracket_node"] = self.bracket_node
+        return data
+
+    @staticmethod
+    def _fields_from_dict(data: Dict) -> Dict:
+        return dict(
+            lobby_id=data["lobby_id"],
+            chat_id=data["chat_id"],
+            admin_id=data["admin_id"],
+            players={username: PlayerSlot.from_dict(player) for username, player in data["players"].items()},
+            created_at=data["created_at"],
+            status=data.get("status", "waiting"),
+            winner=data.get("winner"),
+            scores=data.get("scores"),
+            finished=data.get("finished", False),
+            tournament_id=data.get("tournament_id"),
+            bracket_node=data.get("bracket_node")
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Lobby":
+        return cls(**Lobby._fields_from_dict(data))
+
+@dataclass(slots=True)
+class HistoryRecord(Lobby):
+    """Завершенное лобби в истории"""
+    finished_at: float = 0.0  # epoch; по нему история упорядочена и устаревает
+
+    def to_dict(self) -> Dict:
+        data = Lobby.to_dict(self)
+        data["finished_at"] = self.finished_at
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "HistoryRecord":
+        return cls(**Lobby._fields_from_dict(data), finished_at=history_finished_at(data))
+
+    @classmethod
+    def from_lobby(cls, lobby: Lobby) -> "HistoryRecord":
+        players = {username: PlayerSlot(player.connected, player.dice) for username, player in lobby.players.items()}
+        return cls(
+            lobby_id=lobby.lobby_id,
+            chat_id=lobby.chat_id,
+            admin_id=lobby.admin_id,
+            players=players,
+            created_at=lobby.created_at,
+            status=lobby.status,
+            winner=lobby.winner,
+            scores=lobby.scores,
+            finished=True,
+            tournament_id=lobby.tournament_id,
+            bracket_node=lobby.bracket_node,
+            finished_at=time.time()
+        )
+
+@dataclass(slots=True)
+class Tournament:
+    """Турнир; участники - упорядоченное множество (dict без значений)"""
+    tournament_id: str
+    chat_id: int
+    admin_id: int
+    max_players: int
+    hours: int
+    created_at: str
+    status: str = "registration"
+    participants: Dict[str, None] = field(default_factory=dict)
+    lobbies: List[str] = field(default_factory=list)
+    channel_message_id: Optional[int] = None
+    current_round: int = 1
+    bracket: Optional[Dict] = None
+
+    def add_participant(self, username: str) -> bool:
+        """Регистрация за O(1): False, если уже участвует или мест нет"""
+        if username in self.participants or len(self.participants) >= self.max_players:
+            return False
+        self.participants[username] = None
+        return True
+
+    def to_dict(self) -> Dict:
+        data = {
+            "tournament_id": self.tournament_id,
+            "chat_id": self.chat_id,
+            "admin_id": self.admin_id,
+            "max_players": self.max_players,
+            "hours": self.hours,
+            "status": self.status,
+            "participants": list(self.participants),
+            "created_at": self.created_at,
+            "lobbies": list(self.lobbies),
+            "channel_message_id": self.channel_message_id,
+            "current_round": self.current_round
+        }
+        if self.bracket is not None:
+            data["bracket"] = copy.deepcopy(self.bracket)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Tournament":
+        return cls(
+            tournament_id=data["tournament_id"],
+            chat_id=data["chat_id"],
+            admin_id=data["admin_id"],
+            max_players=data["max_players"],
+            hours=data["hours"],
+            created_at=data["created_at"],
+            status=data.get("status", "registration"),
+            participants=dict.fromkeys(data.get("participants", [])),
+            lobbies=list(data.get("lobbies", [])),
+            channel_message_id=data.get("channel_message_id"),
+            current_round=data.get("current_round", 1),
+            bracket=data.get("bracket")
+        )
+
+# Таблицы хранилища, записи которых превращаются в модели
+MODELS = {
+    "lobbies": Lobby,
+    "tournaments": Tournament,
+    "history": HistoryRecord
+}
\ No newline at end of file
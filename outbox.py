@@ -0,0 +1,292 @@
+# outbox.py
+import asyncio
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше - раньше
+PRIORITY_GAME = 0      # ход игры и результаты
+PRIORITY_ANNOUNCE = 1  # лобби турнира и посты в канале
+PRIORITY_ADMIN = 2     # уведомления админу
+
+
+class TokenBucket:
+    """Ведро токенов с резервированием: возвращает, сколько ждать до отправки"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, seconds: float):
+        """Сдвиг ведра после RetryAfter: следующие отправки подождут"""
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+class Outbox:
+    """Очередь исходящих запросов к Telegram.
+
+    Общий диспетчер выбирает запросы по приоритету и выдает их с глобальной
+    скоростью, затем каждый чат отправляет свою очередь отдельной задачей со
+    своим ведром токенов. Разные чаты отправляются параллельно, внутри чата
+    порядок сохраняется. RetryAfter приостанавливает только свой чат.
+    """
+
+    def __init__(
+        self,
+        get_bot: Callable,
+        global_rate: float = 25,
+        chat_rate: float = 1,
+        group_rate: float = 20 / 60,
+        chat_burst: int = 3,
+        max_concurrency: int = 16,
+        max_retries: int = 3
+    ):
+        self._get_bot = get_bot
+        self._global = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._lanes: Dict[int, asyncio.PriorityQueue] = {}
+        self._lane_tasks: Dict[int, asyncio.Task] = {}
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        # Неотправленные запросы по чатам, включая еще не разобранные диспетчером
+        self._chat_pending: Dict[int, int] = {}
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def submit(self, chat_id: int, request: Callable[[], Awaitable], priority: int = PRIORITY_GAME) -> asyncio.Future:
+        """Постановка запроса в очередь; результат можно дождаться через Future"""
+        future = asyncio.get_running_loop().create_future()
+        # Ошибка уже записана в лог: не ругаемся на неполученное исключение
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._chat_pending[chat_id] = self._chat_pending.get(chat_id, 0) + 1
+        future.add_done_callback(lambda f: self._release_pending(chat_id))
+        self._queue.put_nowait((priority, next(self._seq), chat_id, request, future))
+        return future
+
+    def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_GAME, **kwargs) -> asyncio.Future:
+        return self.submit(
+            chat_id,
+            lambda: self._get_bot().send_message(chat_id, text, **kwargs),
+            priority
+        )
+
+    def pending_count(self) -> int:
+        return self._queue.qsize() + sum(lane.qsize() for lane in self._lanes.values())
+
+    def expected_delay(self, chat_id: int) -> float:
+        """Оценка ожидания в очереди для нового запроса в чат, секунд.
+        Приоритеты не учитываются: это верхняя оценка для запросов не ниже уже стоящих"""
+        pending = self._chat_pending.get(chat_id, 0)
+        bucket = self._chat_buckets.get(chat_id)
+        tokens = bucket.tokens if bucket is not None else self.chat_burst
+        return max(0.0, pending + 1 - tokens) / self._chat_rate(chat_id)
+
+    def _release_pending(self, chat_id: int):
+        left = self._chat_pending.get(chat_id, 0) - 1
+        if left > 0:
+            self._chat_pending[chat_id] = left
+        else:
+            self._chat_pending.pop(chat_id, None)
+
+    async def start(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def stop(self, timeout: float = 10.0):
+        """Отправка оставшегося (не дольше timeout) и остановка"""
+        deadline = time.monotonic() + timeout
+        while self.pending_count() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+        tasks = list(self._lane_tasks.values())
+        if self._dispatcher:
+            tasks.append(self._dispatcher)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._dispatcher = None
+
+    async def _dispatch(self):
+        while True:
+            item = await self._queue.get()
+            delay = self._global.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+
+            chat_id = item[2]
+            lane = self._lanes.get(chat_id)
+            if lane is None:
+                lane = self._lanes[chat_id] = asyncio.PriorityQueue()
+            lane.put_nowait(item)
+
+            if chat_id not in self._lane_tasks:
+                self._lane_tasks[chat_id] = asyncio.create_task(self._run_lane(chat_id, lane))
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self._chat_rate(chat_id), self.chat_burst)
+        return bucket
+
+    def _chat_rate(self, chat_id: int) -> float:
+        # Отрицательные ID - группы и каналы, у них лимит ниже
+        return self.group_rate if chat_id < 0 else self.chat_rate
+
+    async def _run_lane(self, chat_id: int, lane: asyncio.PriorityQueue):
+        try:
+            while not lane.empty():
+                _, _, _, request, future = lane.get_nowait()
+                if future.cancelled():
+                    continue
+
+                bucket = self._chat_bucket(chat_id)
+                delay = bucket.reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+
+                await self._send(chat_id, bucket, request, future)
+        finally:
+            # Пустой чат не держит ни задачу, ни очередь
+            del self._lane_tasks[chat_id]
+            if lane.empty():
+                self._lanes.pop(chat_id, None)
+
+    async def _send(self, chat_id: int, bucket: TokenBucket, request: Callable[[], Awaitable], future: asyncio.Future):
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    result = await request()
+                if not future.done():
+                    future.set_result(result)
+                return
+            except TelegramRetryAfter as e:
+                logger.warning(f"Flood limit в чате {chat_id}: ждем {e.retry_after} с")
+                bucket.pause(e.retry_after)
+                if attempt == self.max_retries:
+                    if not future.done():
+                        future.set_exception(e)
+                    return
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                logger.error(f"Ошибка отправки в чат {chat_id}: {e}")
+                if not future.done():
+                    future.set_exception(e)
+                return
+
+
+class EditCoalescer:
+    """Правки сообщений с объединением: по (чат, message_id) хранится только
+    последний желаемый текст.
+
+    Одно сообщение правится не чаще раза в interval и не больше одной правки
+    за раз; промежуточные тексты просто заменяются. Правка на тот же текст, что
+    уже показан (тот же текст и разметка), не отправляется. Запрос уходит через Outbox, а текст берется в
+    момент отправки, поэтому повтор после RetryAfter отправит уже свежий текст.
+    Последние отправленные тексты хранятся в ограниченном TTL-кэше.
+    """
+
+    def __init__(
+        self,
+        outbox: Outbox,
+        get_bot: Callable,
+        interval: float = 3.0,
+        max_messages: int = 1000,
+        state_ttl: float = 3600
+    ):
+        self._outbox = outbox
+        self._get_bot = get_bot
+        self.interval = interval
+        # (чат, message_id) -> (текст, разметка, приоритет), ждущие отправки
+        self._pending: Dict[tuple, tuple] = {}
+        # (чат, message_id) -> (текст, разметка, время отправки)
+        self._sent = TTLCache(maxsize=max_messages, ttl=state_ttl)
+        # Ключи с запланированной или выполняющейся правкой; значение - таймер или None
+        self._scheduled: Dict[tuple, Optional[asyncio.TimerHandle]] = {}
+        self.stats = {"sent": 0, "superseded": 0, "unchanged": 0}
+
+    def edit(self, chat_id: int, message_id: int, text: str, reply_markup=None, priority: int = PRIORITY_ANNOUNCE):
+        """Желаемый текст сообщения; возвращается сразу, правка уйдет позже"""
+        key = (chat_id, message_id)
+        sent = self._sent.get(key)
+        if key not in self._pending and sent is not None and sent[:2] == (text, reply_markup):
+            self.stats["unchanged"] += 1
+            return
+        if key in self._pending:
+            self.stats["superseded"] += 1
+        self._pending[key] = (text, reply_markup, priority)
+        if key not in self._scheduled:
+            self._schedule(key)
+
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def _schedule(self, key: tuple):
+        sent = self._sent.get(key)
+        delay = max(0.0, sent[2] + self.interval - time.monotonic()) if sent else 0.0
+        self._scheduled[key] = asyncio.get_running_loop().call_later(delay, self._dispatch, key)
+
+    def _dispatch(self, key: tuple):
+        self._scheduled[key] = None
+        priority = self._pending[key][2] if key in self._pending else PRIORITY_ANNOUNCE
+        future = self._outbox.submit(key[0], lambda: self._perform(key), priority)
+        future.add_done_callback(lambda f: self._on_done(key))
+
+    def _on_done(self, key: tuple):
+        del self._scheduled[key]
+        # За время отправки мог появиться текст новее
+        if key in self._pending:
+            self._schedule(key)
+
+    async def _perform(self, key: tuple):
+        entry = self._pending.pop(key, None)
+        if entry is None:
+            return None
+        text, reply_markup, _ = entry
+        sent = self._sent.get(key)
+        if sent is not None and sent[:2] == (text, reply_markup):
+            self.stats["unchanged"] += 1
+            return None
+        try:
+            result = await self._get_bot().edit_message_text(
+                chat_id=key[0], message_id=key[1], text=text, reply_markup=reply_markup
+            )
+        except TelegramRetryAfter:
+            # Outbox подождет и повторит; вернем текст, если новее еще нет
+            self._pending.setdefault(key, entry)
+            raise
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+            result = None
+        self._sent[key] = (text, reply_markup, time.monotonic())
+        self.stats["sent"] += 1
+        return result
+
+    def flush(self):
+        """Отправка отложенных правок без ожидания интервала (перед остановкой Outbox)"""
+        for key, handle in list(self._scheduled.items()):
+            if handle is not None:
+                handle.cancel()
+                self._dispatch(key)
\ No newline at end of file
@@ -0,0 +1,120 @@
+# profiling.py
+import contextvars
+import cProfile
+import functools
+import inspect
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Трассировка одного апдейта: время делится на сегменты db, api и format.
+# Трасса лежит в contextvar, поэтому видна только коду, который выполняется
+# в задаче этого апдейта; фоновые отправки outbox в нее не попадают
+
+class UpdateTrace:
+    """Накопленное время сегментов одного апдейта"""
+    __slots__ = ("segments", "calls", "_open")
+
+    def __init__(self):
+        self.segments: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self._open = False
+
+    def add(self, segment: str, elapsed: float):
+        self.segments[segment] = self.segments.get(segment, 0.0) + elapsed
+        self.calls[segment] = self.calls.get(segment, 0) + 1
+
+_current_trace: contextvars.ContextVar[Optional[UpdateTrace]] = contextvars.ContextVar("update_trace", default=None)
+
+def current_trace() -> Optional[UpdateTrace]:
+    return _current_trace.get()
+
+def start_trace() -> contextvars.Token:
+    return _current_trace.set(UpdateTrace())
+
+def finish_trace(token: contextvars.Token):
+    _current_trace.reset(token)
+
+def record(segment: str, elapsed: float):
+    """Добавить уже измеренное время (например, из middleware сессии бота)"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(segment, elapsed)
+
+@contextmanager
+def segment(name: str):
+    """Замер синхронного участка; вложенные сегменты не считаются дважды"""
+    trace = _current_trace.get()
+    if trace is None or trace._open:
+        yield
+        return
+    trace._open = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace._open = False
+        trace.add(name, time.perf_counter() - started)
+
+def traced(name: str):
+    """Декоратор синхронной функции: ее время идет в сегмент name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return func(*args, **kwargs)
+            with segment(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def traced_methods(name: str):
+    """Декоратор класса: все публичные синхронные методы идут в сегмент name"""
+    def decorator(cls):
+        for attr, value in list(vars(cls).items()):
+            if attr.startswith("_") or not inspect.isfunction(value) or inspect.iscoroutinefunction(value):
+                continue
+            setattr(cls, attr, traced(name)(value))
+        return cls
+    return decorator
+
+# ========== СЭМПЛЫ МЕДЛЕННЫХ АПДЕЙТОВ ==========
+
+class ProfileStore:
+    """Каталог с отчетами о медленных апдейтах; хранятся последние keep"""
+
+    def __init__(self, directory: str, keep: int = 50):
+        self.directory = directory
+        self.keep = keep
+
+    def _reports(self) -> List[str]:
+        names = sorted(n for n in os.listdir(self.directory) if n.startswith("slow-"))
+        return [os.path.join(self.directory, n) for n in names]
+
+    def write(self, report: Dict, profile: Optional[cProfile.Profile] = None) -> str:
+        """Сохранить отчет (JSON) и, если был, профиль cProfile (.prof для pstats/snakeviz)"""
+        os.makedirs(self.directory, exist_ok=True)
+        # Время в имени сохраняет порядок отчетов при сортировке
+        now = time.time_ns()
+        stamp = time.strftime('%Y%m%d%H%M%S', time.localtime(now // 10**9))
+        base = os.path.join(self.directory, f"slow-{stamp}-{now % 10**9:09d}")
+        if profile is not None:
+            profile.dump_stats(base + ".prof")
+            report["profile"] = os.path.basename(base + ".prof")
+        with open(base + ".json", 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        self._rotate()
+        return base + ".json"
+
+    def _rotate(self):
+        # У отчета может быть пара .prof, поэтому считаем по .json
+        reports = [path for path in self._reports() if path.endswith(".json")]
+        for path in reports[:-self.keep] if self.keep else []:
+            for stale in (path, path[:-len(".json")] + ".prof"):
+                if os.path.exists(stale):
+                    os.remove(stale)
\ No newline at end of file
@@ -0,0 +1,115 @@
+# scheduler.py
+import asyncio
+import heapq
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """Таймеры, переживающие перезапуск бота.
+
+    Дедлайны хранятся в базе (таблица timers), в памяти - только куча
+    (fire_at, job_id) и одна задача-драйвер, которая спит до ближайшего
+    срабатывания. Отмена и перенос не трогают кучу: устаревшие элементы
+    отбрасываются при извлечении, если дедлайн в базе уже другой.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._handlers: Dict[str, Callable[..., Awaitable]] = {}
+        self._heap: List[tuple] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running = set()
+
+    def register(self, kind: str, handler: Callable[..., Awaitable]):
+        """Регистрация обработчика для типа таймера"""
+        self._handlers[kind] = handler
+
+    def schedule(self, job_id: str, kind: str, delay: float, **kwargs):
+        """Постановка таймера; существующий таймер с тем же job_id заменяется"""
+        fire_at = time.time() + delay
+        self.db.save_timer(job_id, {"kind": kind, "fire_at": fire_at, "kwargs": kwargs})
+        self._push(fire_at, job_id)
+
+    reschedule = schedule
+
+    def cancel(self, job_id: str):
+        self.db.delete_timer(job_id)
+
+    def pending_count(self) -> int:
+        return len(self.db.get_timers())
+
+    async def start(self):
+        """Загрузка таймеров из базы; просроченные сработают сразу"""
+        self._heap = [(job["fire_at"], job_id) for job_id, job in self.db.get_timers().items()]
+        heapq.heapify(self._heap)
+        logger.info(f"Восстановлено таймеров: {len(self._heap)}")
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # Прерванные обработчики остаются в базе и повторятся после запуска
+        for task in list(self._running):
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+    def _push(self, fire_at: float, job_id: str):
+        heapq.heappush(self._heap, (fire_at, job_id))
+        if self._heap[0][1] == job_id:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            fire_at, job_id = self._heap[0]
+            delay = fire_at - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            job = self.db.get_timer(job_id)
+            if job is None or job["fire_at"] != fire_at:
+                continue  # отменен или перенесен
+
+            task = asyncio.create_task(self._fire(job_id, job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _fire(self, job_id: str, job: Dict):
+        handler = self._handlers.get(job["kind"])
+        if handler is None:
+            logger.error(f"Нет обработчика для таймера {job_id} ({job['kind']})")
+            self.db.delete_timer(job_id)
+            return
+
+        try:
+            await handler(**job["kwargs"])
+        except Exception as e:
+            logger.error(f"Ошибка в таймере {job_id}: {e}")
+
+        # Удаляем только если обработчик не поставил таймер заново
+        current = self.db.get_timer(job_id)
+        if current is not None and current["fire_at"] == job["fire_at"]:
+            self.db.delete_timer(job_id)
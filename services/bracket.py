@@ -0,0 +1,94 @@
+# services/bracket.py
+"""Сетка турнира на выбывание.
+
+Сетка хранится как плоский массив в раскладке двоичной кучи: узел 1 - финал,
+дети узла i - 2i и 2i+1, листья size..2*size-1 - посев. В slots[i] лежит
+победитель узла: None - еще не определен, "" - никто не прошел (пустой слот
+или оба проиграли), иначе username. Такой словарь целиком сериализуется в JSON
+вместе с турниром.
+"""
+from typing import Dict, List, Optional
+
+EMPTY = ""
+
+
+def create_bracket(participants: List[str]) -> Dict:
+    """Посев участников; пустые слоты (bye) достаются первым парам"""
+    size = 2
+    while size < len(participants):
+        size *= 2
+
+    slots: List[Optional[str]] = [None] * (2 * size)
+    byes = size - len(participants)
+    players = iter(participants)
+    for pair in range(size // 2):
+        leaf = size + 2 * pair
+        slots[leaf] = next(players, EMPTY)
+        slots[leaf + 1] = EMPTY if pair < byes else next(players, EMPTY)
+
+    bracket = {"size": size, "slots": slots, "lobbies": {}}
+    for node in range(size - 1, 0, -1):
+        _resolve_walkover(bracket, node)
+    return bracket
+
+
+def _resolve_walkover(bracket: Dict, node: int) -> bool:
+    """Проход без игры, если у узла пустой соперник"""
+    slots = bracket["slots"]
+    left, right = slots[2 * node], slots[2 * node + 1]
+    if slots[node] is not None or left is None or right is None:
+        return False
+    if left != EMPTY and right != EMPTY:
+        return False
+    slots[node] = left or right
+    return True
+
+
+def _is_ready(bracket: Dict, node: int) -> bool:
+    slots = bracket["slots"]
+    return (
+        slots[node] is None
+        and str(node) not in bracket["lobbies"]
+        and bool(slots[2 * node])
+        and bool(slots[2 * node + 1])
+    )
+
+
+def ready_matches(bracket: Dict) -> List[tuple]:
+    """Все матчи, для которых известны оба соперника: (узел, игрок 1, игрок 2)"""
+    slots = bracket["slots"]
+    return [
+        (node, slots[2 * node], slots[2 * node + 1])
+        for node in range(bracket["size"] - 1, 0, -1)
+        if _is_ready(bracket, node)
+    ]
+
+
+def attach_lobby(bracket: Dict, node: int, lobby_id: str):
+    bracket["lobbies"][str(node)] = lobby_id
+
+
+def record_result(bracket: Dict, node: int, winner: Optional[str]) -> List[tuple]:
+    """Фиксация итога матча; возвращает матчи, которые можно начинать"""
+    slots = bracket["slots"]
+    if slots[node] is not None:
+        return []
+    slots[node] = winner or EMPTY
+
+    # Поднимаемся вверх, пока соседний матч уже решен проходом без игры
+    parent = node // 2
+    while parent >= 1 and _resolve_walkover(bracket, parent):
+        parent //= 2
+
+    if parent >= 1 and _is_ready(bracket, parent):
+        return [(parent, slots[2 * parent], slots[2 * parent + 1])]
+    return []
+
+
+def champion(bracket: Dict) -> Optional[str]:
+    return bracket["slots"][1] or None
+
+
+def round_of(bracket: Dict, node: int) -> int:
+    """Номер раунда матча: 1 - первый раунд, последний - финал"""
+    return bracket["size"].bit_length() - node.bit_length()
@@ -0,0 +1,36 @@
+# services/retention.py
+import asyncio
+import logging
+from dependencies import get_db, get_scheduler
+from config import HISTORY_RETENTION_DAYS, HISTORY_RETENTION_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+scheduler = get_scheduler()
+
+RETENTION_JOB_ID = "history_retention"
+
+# Плановый запуск и /cleanup не должны архивировать одни и те же записи
+_retention_lock = asyncio.Lock()
+
+async def run_history_retention(days: int = HISTORY_RETENTION_DAYS) -> int:
+    """Перенос истории старше days дней в архив"""
+    async with _retention_lock:
+        expired = await get_db().clear_old_data(days)
+    if expired:
+        logger.info(f"В архив перенесено записей истории: {expired}")
+    return expired
+
+async def history_retention_job():
+    """Периодическая задача: вытеснение устаревшей истории и перезапуск таймера"""
+    try:
+        await run_history_retention()
+    finally:
+        scheduler.schedule(RETENTION_JOB_ID, RETENTION_JOB_ID, HISTORY_RETENTION_INTERVAL)
+
+def ensure_retention_job():
+    """Постановка задачи при первом запуске; после перезапуска она уже в базе"""
+    if get_db().get_timer(RETENTION_JOB_ID) is None:
+        scheduler.schedule(RETENTION_JOB_ID, RETENTION_JOB_ID, HISTORY_RETENTION_INTERVAL)
+
+scheduler.register(RETENTION_JOB_ID, history_retention_job)
\ No newline at end of file
@@ -1,13 +1,19 @@
 # services/tournament_service.py
-import asyncio
 import logging
 import time
-from dependencies import get_bot, get_db
+from dependencies import get_db, get_outbox, get_scheduler, get_tournament_locks
 from keyboards import get_connect_keyboard, get_tournament_join_keyboard
-from config import ALLOWED_CHANNEL_ID, ALLOWED_CHAT_ID
+from config import ALLOWED_CHANNEL_ID, ALLOWED_CHAT_ID, GAME_TIMEOUT
+from services.bracket import create_bracket, ready_matches, attach_lobby, record_result, champion, round_of
+from outbox import PRIORITY_ANNOUNCE
+from models import Lobby
 
 logger = logging.getLogger(__name__)
 
+scheduler = get_scheduler()
+outbox = get_outbox()
+tournament_locks = get_tournament_locks()
+
 async def create_tournament_command(admin_id: int, max_players: int, hours: int) -> str:
     """Создание турнира через админ-панель"""
     try:
@@ -21,10 +27,9 @@ async def create_tournament_command(admin_id: int, max_players: int, hours: int)
         
         logger.info(f"Создан турнир {tournament_id} для {max_players} игроков на {hours} часов")
         
-        bot = get_bot()
-        
         try:
-            tournament_message = await bot.send_message(
+            # Нужен message_id, поэтому дожидаемся отправки
+            tournament_message = await outbox.send_message(
                 ALLOWED_CHANNEL_ID,
                 f"<b>🎯 ОБЪЯВЛЕН НОВЫЙ ТУРНИР 🎯</b>\n\n"
                 f"<code>🆔 ID: {tournament_id}</code>\n"
@@ -33,6 +38,7 @@ async def create_tournament_command(admin_id: int, max_players: int, hours: int)
                 f"<b>🎮 Игры пройдут в основном чате</b>\n\n"
                 f"<b>⚡ Участвуйте в турнире !</b>\n"
                 f"<blockquote>🏆 Победитель получит славу и уважение ! 🏆</blockquote>",
+                priority=PRIORITY_ANNOUNCE,
                 reply_markup=get_tournament_join_keyboard(tournament_id)
             )
             
@@ -45,7 +51,12 @@ async def create_tournament_command(admin_id: int, max_players: int, hours: int)
             
         # Запускаем таймер для автоматического старта турнира
         tournament_timeout = hours * 3600
-        asyncio.create_task(tournament_timeout_func(tournament_id, tournament_timeout))
+        scheduler.schedule(
+            f"tournament_registration:{tournament_id}",
+            "tournament_registration",
+            tournament_timeout,
+            tournament_id=tournament_id
+        )
         
         return tournament_id
         
@@ -53,148 +64,236 @@ async def create_tournament_command(admin_id: int, max_players: int, hours: int)
         logger.error(f"Ошибка создания турнира: {e}")
         raise e
 
-async def tournament_timeout_func(tournament_id: str, timeout: int):
-    """Таймер для автоматического старта турнира"""
-    await asyncio.sleep(timeout)
+def request_tournament_start(tournament_id: str) -> bool:
+    """Закрытие регистрации и постановка старта в фон.
     
+    Статус registration -> starting меняется как compare-and-set, поэтому
+    старт запрашивается ровно один раз, кто бы ни успел первым: последний
+    участник или таймер регистрации. Сам старт идет задачей планировщика и
+    после падения бота повторится при запуске"""
+    db = get_db()
+    if not db.compare_and_set_tournament_status(tournament_id, "registration", "starting"):
+        return False
+    scheduler.cancel(f"tournament_registration:{tournament_id}")
+    scheduler.schedule(f"tournament_start:{tournament_id}", "tournament_start", 0, tournament_id=tournament_id)
+    return True
+
+async def tournament_timeout_func(tournament_id: str):
+    """Таймер для автоматического старта турнира"""
+    async with tournament_locks(tournament_id):
+        if request_tournament_start(tournament_id):
+            logger.info(f"Регистрация турнира {tournament_id} завершена по таймеру")
+
+async def tournament_start_func(tournament_id: str):
+    """Фоновый старт турнира со статусом starting"""
+    async with tournament_locks(tournament_id):
+        await _start_tournament(tournament_id)
+
+async def _start_tournament(tournament_id: str):
     db = get_db()
     tournament_data = db.get_tournament(tournament_id)
-    if tournament_data and tournament_data["status"] == "registration":
-        bot = get_bot()
-        
-        participants = tournament_data["participants"]
+    if tournament_data and tournament_data.status == "starting":
+        participants = list(tournament_data.participants)
         logger.info(f"Регистрация турнира {tournament_id} завершена. Участников: {len(participants)}")
         
         if len(participants) >= 2:
-            lobbies = await create_tournament_lobbies(tournament_id, participants)
-            db.update_tournament_status(tournament_id, "started", lobbies)
+            # Сетка, лобби, их таймеры и новый статус пишутся одной пачкой:
+            # после падения посреди старта задача повторится с чистого листа
+            with db.transaction():
+                lobbies = await create_tournament_lobbies(tournament_id, participants)
+                db.update_tournament_status(tournament_id, "started", lobbies)
             
-            await bot.send_message(
+            # Заполненный турнир стартует раньше срока регистрации
+            duration_line = (
+                f"<b>⏰ Регистрация длилась: {tournament_data.hours} ч.</b>\n"
+                if len(participants) < tournament_data.max_players else ""
+            )
+            outbox.send_message(
                 ALLOWED_CHANNEL_ID,
                 f"<b>🎯 ТУРНИР НАЧАЛСЯ 🎯</b>\n\n"
                 f"<code>🆔 ID: {tournament_id}</code>\n"
                 f"<b>👥 Участников: {len(participants)}</b>\n"
                 f"<b>🎮 Создано игр: {len(lobbies)}</b>\n"
-                f"<b>⏰ Регистрация длилась: {tournament_data['hours']} ч.</b>\n"
+                f"{duration_line}"
                 f"<b>📍 Игры проходят в основном чате</b>\n\n"
                 f"<b>⚡ Удачи всем игрокам !</b>\n"
-                f"<blockquote>🏆 Сражайтесь за победу ! 🏆</blockquote>"
+                f"<blockquote>🏆 Сражайтесь за победу ! 🏆</blockquote>",
+                priority=PRIORITY_ANNOUNCE
             )
             
-            # Запускаем проверку завершения турнира
-            asyncio.create_task(check_tournament_completion(tournament_id))
+            # Все игры могли закончиться еще до смены статуса
+            check_tournament_completion(tournament_id)
             
         else:
             db.update_tournament_status(tournament_id, "cancelled")
-            await bot.send_message(
+            outbox.send_message(
                 ALLOWED_CHANNEL_ID,
                 f"<b>❌ ТУРНИР ОТМЕНЕН ❌</b>\n\n"
                 f"<code>🆔 ID: {tournament_id}</code>\n"
-                f"<b>👥 Недостаточно участников: {len(participants)}/{tournament_data['max_players']}</b>\n"
-                f"<b>⏰ Регистрация длилась: {tournament_data['hours']} ч.</b>\n"
-                f"<blockquote>😞 В следующий раз будет больше участников ! 😞</blockquote>"
+                f"<b>👥 Недостаточно участников: {len(participants)}/{tournament_data.max_players}</b>\n"
+                f"<b>⏰ Регистрация длилась: {tournament_data.hours} ч.</b>\n"
+                f"<blockquote>😞 В следующий раз будет больше участников ! 😞</blockquote>",
+                priority=PRIORITY_ANNOUNCE
             )
 
+def create_match_lobby(tournament_id: str, node: int, username1: str, username2: str) -> str:
+    """Создание лобби для матча сетки и запуск его таймера"""
+    return create_match_lobbies(tournament_id, [(node, username1, username2)])[0]
+
+def create_match_lobbies(tournament_id: str, matches: list) -> list:
+    """Лобби для готовых матчей сетки одной транзакцией, с таймерами"""
+    db = get_db()
+    tournament_data = db.get_tournament(tournament_id)
+    
+    with db.transaction():
+        lobbies = db.create_lobbies_bulk(
+            tournament_data.chat_id,
+            tournament_data.admin_id,
+            [(username1, username2) for _, username1, username2 in matches],
+            tournament_id=tournament_id,
+            bracket_nodes=[node for node, _, _ in matches]
+        )
+        for lobby_id, (node, _, _) in zip(lobbies, matches):
+            attach_lobby(tournament_data.bracket, node, lobby_id)
+            # Предварительный таймер: announce_match_lobby добавит ожидание объявления
+            # в очереди, а после доставки отсчет начнется заново
+            scheduler.schedule(f"game_timeout:{lobby_id}", "game_timeout", GAME_TIMEOUT, lobby_id=lobby_id)
+    return lobbies
+
+def announce_match_lobby(lobby_id: str, round_title: str):
+    """Сообщение о создании лобби матча в чате"""
+    db = get_db()
+    
+    lobby_data = db.get_lobby(lobby_id)
+    if not lobby_data:
+        return
+    username1, username2 = lobby_data.players.keys()
+    
+    # Кнопка подключения есть только в объявлении, а в чате оно может долго
+    # ждать лимита отправки: время на игру отсчитывается от доставки
+    scheduler.reschedule(
+        f"game_timeout:{lobby_id}", "game_timeout",
+        GAME_TIMEOUT + outbox.expected_delay(lobby_data.chat_id), lobby_id=lobby_id
+    )
+    
+    announcement = outbox.send_message(
+        lobby_data.chat_id,
+        f"<b>🎮 ТУРНИРНОЕ ЛОББИ СОЗДАНО ! 🎮</b>\n\n"
+        f"<code>🆔 ID: {lobby_id}</code>\n"
+        f"<b>🏁 {round_title}</b>\n\n"
+        f"<b>👤 @{username1} vs 👤 @{username2}</b>\n\n"
+        f"<b>🎲 Игра: Кубы PvP</b>\n\n"
+        f"<b>⏰ Время на броски: 5 минут !</b>\n"
+        f"<b>❌ Если не бросите - автоматическое поражение !</b>\n\n"
+        f"<blockquote>⚡ Удачи в турнире ! ⚡</blockquote>",
+        priority=PRIORITY_ANNOUNCE,
+        reply_markup=get_connect_keyboard(lobby_id)
+    )
+    announcement.add_done_callback(lambda future: _on_match_announced(lobby_id, future))
+
+def _on_match_announced(lobby_id: str, future):
+    """Перезапуск таймера лобби, когда объявление с кнопкой дошло до чата"""
+    if future.cancelled() or future.exception():
+        # Остается предварительный таймер: лобби все равно не повиснет
+        return
+    lobby_data = get_db().get_lobby(lobby_id)
+    # Если оба уже подключились, таймер игры запущен при подключении
+    if lobby_data and lobby_data.status == "waiting":
+        scheduler.reschedule(f"game_timeout:{lobby_id}", "game_timeout", GAME_TIMEOUT, lobby_id=lobby_id)
+
+def get_round_title(tournament_bracket: dict, node: int) -> str:
+    if node == 1:
+        return "ФИНАЛ"
+    return f"Раунд {round_of(tournament_bracket, node)}"
+
 async def create_tournament_lobbies(tournament_id: str, participants: list) -> list:
-    """Создание лобби для турнира"""
-    bot = get_bot()
+    """Посев сетки и создание лобби первого раунда"""
     db = get_db()
     
     tournament_data = db.get_tournament(tournament_id)
     if not tournament_data:
         return []
     
-    lobbies = []
-    # Разбиваем участников на пары
-    for i in range(0, len(participants), 2):
-        if i + 1 < len(participants):
-            username1 = participants[i]
-            username2 = participants[i + 1]
-            
-            # Создаем лобби
-            lobby_id = db.create_lobby(
-                tournament_data["chat_id"],
-                tournament_data["admin_id"],
-                username1,
-                username2
-            )
-            
-            # Устанавливаем tournament_id для лобби
-            db.set_lobby_tournament_id(lobby_id, tournament_id)
-            
-            lobbies.append(lobby_id)
-            
-            # Отправляем сообщение о создании лобби
-            await bot.send_message(
-                tournament_data["chat_id"],
-                f"<b>🎮 ТУРНИРНОЕ ЛОББИ СОЗДАНО ! 🎮</b>\n\n"
-                f"<code>🆔 ID: {lobby_id}</code>\n\n"
-                f"<b>👤 @{username1} vs 👤 @{username2}</b>\n\n"
-                f"<b>🎲 Игра: Кубы PvP</b>\n\n"
-                f"<b>⏰ Время на броски: 5 минут !</b>\n"
-                f"<b>❌ Если не бросите - автоматическое поражение !</b>\n\n"
-                f"<blockquote>⚡ Удачи в турнире ! ⚡</blockquote>",
-                reply_markup=get_connect_keyboard(lobby_id)
-            )
-            
-            # Запускаем таймер для лобби
-            asyncio.create_task(game_timeout(lobby_id))
+    # Нечетное число участников закрывается проходами без игры
+    tournament_bracket = create_bracket(participants)
+    db.update_tournament_bracket(tournament_id, tournament_bracket)
+    
+    matches = ready_matches(tournament_bracket)
+    lobbies = create_match_lobbies(tournament_id, matches)
+    db.update_tournament_bracket(tournament_id, tournament_bracket)
+    
+    # Объявления уходят через очередь, сетка не ждет отправки
+    for lobby_id, (node, _, _) in zip(lobbies, matches):
+        announce_match_lobby(lobby_id, get_round_title(tournament_bracket, node))
     
     return lobbies
 
-async def game_timeout(lobby_id: str):
-    """Таймаут для игры в турнире"""
-    from handlers.game import game_timeout as base_game_timeout
-    await base_game_timeout(lobby_id)
-
-async def check_tournament_completion(tournament_id: str):
-    """Проверка завершения турнира"""
-    bot = get_bot()
+def on_lobby_closed(lobby_data: Lobby):
+    """Событие завершения лобби: продвигаем сетку и проверяем турнир"""
+    tournament_id = lobby_data.tournament_id
+    if not tournament_id:
+        return
+        
     db = get_db()
+    tournament_data = db.get_tournament(tournament_id)
+    node = lobby_data.bracket_node
     
-    # Проверяем каждые 30 секунд
-    while True:
-        await asyncio.sleep(30)
+    if tournament_data and tournament_data.bracket and node is not None:
+        tournament_bracket = tournament_data.bracket
         
-        tournament_data = db.get_tournament(tournament_id)
-        if not tournament_data or tournament_data["status"] != "started":
-            return
-            
-        all_finished = True
-        winners = []
+        # Следующий матч создается, как только известны оба соперника,
+        # не дожидаясь конца всего раунда
+        with db.transaction():
+            for next_node, username1, username2 in record_result(tournament_bracket, node, lobby_data.winner):
+                lobby_id = create_match_lobby(tournament_id, next_node, username1, username2)
+                
+                round_number = round_of(tournament_bracket, next_node)
+                if round_number > tournament_data.current_round:
+                    db.update_tournament_round(tournament_id, round_number)
+                    
+                announce_match_lobby(lobby_id, get_round_title(tournament_bracket, next_node))
+                
+            db.update_tournament_bracket(tournament_id, tournament_bracket)
         
-        # Проверяем все лобби турнира
-        for lobby_id in tournament_data["lobbies"]:
-            # Проверяем в активных лобби
-            active_lobbies = db.get_all_lobbies()
-            if lobby_id in active_lobbies:
-                all_finished = False
-                break
-            
-            # Проверяем в истории (завершенные игры)
-            history_data = db._read_data().get("history", {})
-            lobby_data = history_data.get(lobby_id)
-            if lobby_data and lobby_data.get("winner"):
-                winners.append(f"@{lobby_data['winner']}")
+    check_tournament_completion(tournament_id)
+
+def check_tournament_completion(tournament_id: str):
+    """Завершение турнира, как только сыгран финал сетки"""
+    db = get_db()
+    
+    tournament_data = db.get_tournament(tournament_id)
+    if not tournament_data or tournament_data.status != "started":
+        return
         
-        # Если все лобби завершены
-        if all_finished:
-            db.update_tournament_status(tournament_id, "completed")
-            
-            # Формируем список победителей
-            winners_text = ", ".join(winners) if winners else "нет победителей"
-            
-            # Отправляем в канал финальные результаты
-            await bot.send_message(
-                ALLOWED_CHANNEL_ID,
-                f"<b>🏆 ТУРНИР ЗАВЕРШЕН 🏆</b>\n\n"
-                f"<code>🎯 ID: {tournament_id}</code>\n"
-                f"<b>👥 Участников: {len(tournament_data['participants'])}</b>\n"
-                f"<b>🎮 Сыграно игр: {len(tournament_data['lobbies'])}</b>\n\n"
-                f"<b>🏅 ПОБЕДИТЕЛИ ТУРНИРА:</b>\n"
-                f"<b>{winners_text}</b>\n\n"
-                f"<b>⚡ Поздравляем победителей !</b>\n"
-                f"<blockquote>🎮 Спасибо всем за участие ! 🎮</blockquote>"
-            )
-            
-            return
\ No newline at end of file
+    if db.count_tournament_lobbies(tournament_id) > 0:
+        return
+        
+    db.update_tournament_status(tournament_id, "completed")
+    announce_tournament_results(tournament_id)
+
+def announce_tournament_results(tournament_id: str):
+    """Публикация итогов турнира в канале"""
+    db = get_db()
+    
+    tournament_data = db.get_tournament(tournament_id)
+    winner = champion(tournament_data.bracket) if tournament_data.bracket else None
+    
+    winners_text = f"@{winner}" if winner else "нет победителя"
+    
+    # Отправляем в канал финальные результаты
+    outbox.send_message(
+        ALLOWED_CHANNEL_ID,
+        f"<b>🏆 ТУРНИР ЗАВЕРШЕН 🏆</b>\n\n"
+        f"<code>🎯 ID: {tournament_id}</code>\n"
+        f"<b>👥 Участников: {len(tournament_data.participants)}</b>\n"
+        f"<b>🎮 Сыграно игр: {len(tournament_data.lobbies)}</b>\n\n"
+        f"<b>🏅 ПОБЕДИТЕЛЬ ТУРНИРА:</b>\n"
+        f"<b>{winners_text}</b>\n\n"
+        f"<b>⚡ Поздравляем победителя !</b>\n"
+        f"<blockquote>🎮 Спасибо всем за участие ! 🎮</blockquote>",
+        priority=PRIORITY_ANNOUNCE
+    )
+
+get_db().add_lobby_closed_listener(on_lobby_closed)
+scheduler.register("tournament_registration", tournament_timeout_func)
+scheduler.register("tournament_start", tournament_start_func)
\ No newline at end of file
@@ -0,0 +1,55 @@
+# storage/archive.py
+import gzip
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+
+class HistoryArchive:
+    """Архив устаревшей истории: JSON-строки в сжатых сегментах с ротацией.
+
+    Запись идет в текущий сегмент history-<номер>-<время>.jsonl.gz. Каждая пачка
+    дописывается отдельным gzip-членом, поэтому сегмент читается целиком
+    обычным gzip. Когда сегмент больше segment_max_bytes, открывается новый.
+    Архив ничего не удаляет сам: только если задан keep_segments, сегменты
+    старше последних keep_segments стираются.
+    """
+
+    def __init__(self, directory: str, segment_max_bytes: int = 4 * 1024 * 1024, keep_segments: Optional[int] = None):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.keep_segments = keep_segments
+        os.makedirs(directory, exist_ok=True)
+
+    def _segments(self) -> List[str]:
+        names = sorted(n for n in os.listdir(self.directory) if n.startswith("history-") and n.endswith(".jsonl.gz"))
+        return [os.path.join(self.directory, n) for n in names]
+
+    def _current_segment(self) -> str:
+        segments = self._segments()
+        if segments and os.path.getsize(segments[-1]) < self.segment_max_bytes:
+            return segments[-1]
+        # Номер с нулями сохраняет порядок сегментов при сортировке имен
+        number = int(os.path.basename(segments[-1]).split("-")[1]) + 1 if segments else 1
+        return os.path.join(self.directory, f"history-{number:06d}-{time.strftime('%Y%m%d%H%M%S')}.jsonl.gz")
+
+    def write(self, records: List[Dict]):
+        """Дописывание записей истории; возвращается после fsync"""
+        if not records:
+            return
+        path = self._current_segment()
+        with open(path, 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='ab') as f:
+                lines = (json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n' for record in records)
+                f.write(''.join(lines).encode('utf-8'))
+            raw.flush()
+            os.fsync(raw.fileno())
+        self._rotate()
+
+    def _rotate(self):
+        if not self.keep_segments:
+            return
+        segments = self._segments()
+        for path in segments[:-self.keep_segments]:
+            os.remove(path)
\ No newline at end of file
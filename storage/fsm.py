@@ -0,0 +1,209 @@
+# storage/fsm.py
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Mapping, Optional
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from cachetools import TLRUCache
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fsm_expires ON fsm(expires_at);
+"""
+
+
+class FSMRecord:
+    """Состояние и данные одного диалога"""
+    __slots__ = ("state", "data", "expires_at")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict] = None, expires_at: float = 0.0):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.expires_at = expires_at
+
+
+def _record_expiry(key, record: FSMRecord, now: float) -> float:
+    return record.expires_at
+
+
+class SqliteFSMStorage(BaseStorage):
+    """FSM-хранилище aiogram, переживающее перезапуск.
+
+    Чтения идут из памяти. Переходы только помечают запись грязной, а
+    фоновая задача раз в flush_interval пишет накопленное одной транзакцией
+    в SQLite в отдельном потоке. Диалог, к которому не обращались ttl
+    секунд, считается брошенным: он пропадает из памяти и стирается на диске.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = 3600,
+        flush_interval: float = 1.0,
+        max_sessions: int = 10000,
+        timer: Callable[[], float] = time.time
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.timer = timer
+        self._key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+
+        # Время истечения хранится на диске, поэтому часы - время эпохи, а не monotonic
+        self._records = TLRUCache(maxsize=max_sessions, ttu=_record_expiry, timer=timer)
+        self._dirty: Dict[str, Optional[FSMRecord]] = {}
+        self._dirty_event = asyncio.Event()
+        self._writer_task: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-writer")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._load_lock = asyncio.Lock()
+        self.flushes = 0
+
+    async def _ensure_loaded(self):
+        """Подгрузка живых диалогов при первом обращении, в потоке записи"""
+        if self._conn is not None:
+            return
+        async with self._load_lock:
+            if self._conn is None:
+                loop = asyncio.get_running_loop()
+                conn, rows = await loop.run_in_executor(self._executor, self._load, self.timer())
+                for key, state, data, expires_at in rows:
+                    self._records[key] = FSMRecord(state, json.loads(data), expires_at)
+                self._conn = conn
+
+    def _load(self, now: float) -> tuple:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        rows = conn.execute(
+            "SELECT key, state, data, expires_at FROM fsm WHERE expires_at > ?", (now,)
+        ).fetchall()
+        return conn, rows
+
+    def _get(self, key: StorageKey) -> tuple:
+        storage_key = self._key_builder.build(key)
+        return storage_key, self._records.get(storage_key)
+
+    def _put(self, storage_key: str, record: FSMRecord):
+        if record.state is None and not record.data:
+            # state.clear(): хранить пустой диалог незачем
+            self._records.pop(storage_key, None)
+            self._mark_dirty(storage_key, None)
+            return
+        record.expires_at = self.timer() + self.ttl
+        # Повторная вставка пересчитывает срок жизни в кэше
+        self._records[storage_key] = record
+        self._mark_dirty(storage_key, record)
+
+    def _mark_dirty(self, storage_key: str, record: Optional[FSMRecord]):
+        self._dirty[storage_key] = record
+        self._dirty_event.set()
+        if self._writer_task is None:
+            self._writer_task = asyncio.get_running_loop().create_task(self._background_writer())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._ensure_loaded()
+        storage_key, record = self._get(key)
+        record = record or FSMRecord()
+        record.state = state.state if isinstance(state, State) else state
+        self._put(storage_key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        await self._ensure_loaded()
+        _, record = self._get(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        await self._ensure_loaded()
+        storage_key, record = self._get(key)
+        record = record or FSMRecord()
+        record.data = data.copy()
+        self._put(storage_key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        await self._ensure_loaded()
+        _, record = self._get(key)
+        return record.data.copy() if record else {}
+
+    # ========== ФОНОВАЯ ЗАПИСЬ ==========
+
+    async def _background_writer(self):
+        while True:
+            try:
+                await self._dirty_event.wait()
+                # Переходы за flush_interval уходят на диск одной транзакцией
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка записи FSM: {e}")
+
+    async def flush(self):
+        """Запись накопленных переходов"""
+        self._dirty_event.clear()
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+
+        # Снимок делается в event loop: хендлеры продолжают менять записи
+        upserts = [
+            (storage_key, record.state, json.dumps(record.data, ensure_ascii=False), record.expires_at)
+            for storage_key, record in dirty.items() if record is not None
+        ]
+        deletes = [(storage_key,) for storage_key, record in dirty.items() if record is None]
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._write, upserts, deletes, self.timer())
+        except Exception:
+            # Не теряем переходы: более свежие версии имеют приоритет
+            for storage_key, record in dirty.items():
+                self._dirty.setdefault(storage_key, record)
+            self._dirty_event.set()
+            raise
+        self.flushes += 1
+
+    def _write(self, upserts: List[tuple], deletes: List[tuple], now: float):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO fsm (key, state, data, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                "expires_at = excluded.expires_at",
+                upserts
+            )
+            self._conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+            self._conn.execute("DELETE FROM fsm WHERE expires_at <= ?", (now,))
+
+    async def close(self) -> None:
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+            self._writer_task = None
+        if self._conn is not None:
+            await self.flush()
+            self._conn.close()
+            self._conn = None
+        self._executor.shutdown(wait=True)
\ No newline at end of file
@@ -0,0 +1,189 @@
+# storage/journal.py
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Iterator
+
+TABLES = ("lobbies", "history", "tournaments", "temp_dice", "timers")
+
+
+def empty_state() -> Dict:
+    return {table: {} for table in TABLES}
+
+
+def apply_record(state: Dict, record: Dict):
+    """Применение одной записи журнала к состоянию"""
+    table = state.setdefault(record["t"], {})
+    if "v" in record:
+        table[record["k"]] = record["v"]
+    else:
+        table.pop(record["k"], None)
+
+
+def encode_record(record: Dict) -> str:
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def history_finished_at(record: Dict) -> float:
+    """Время завершения игры (epoch); у старых записей - время создания лобби"""
+    finished_at = record.get("finished_at")
+    if finished_at is None:
+        finished_at = datetime.fromisoformat(record["created_at"]).timestamp()
+    return finished_at
+
+
+class JournalStorage:
+    """Снимок в JSON + журнал изменений, который дописывается в конец.
+
+    Каждая запись журнала - одна строка: {"t": таблица, "k": ключ, "v": значение}.
+    Запись без "v" означает удаление ключа. Пачка из нескольких записей пишется
+    одной строкой {"b": [записи]} и поэтому применяется целиком или никак.
+    Записи идемпотентны, поэтому повторное применение хвоста журнала
+    к свежему снимку безопасно.
+    """
+
+    def __init__(self, snapshot_path: str, compact_every: int = 1000):
+        self.snapshot_path = snapshot_path
+        self.journal_path = os.path.splitext(snapshot_path)[0] + ".journal"
+        self.compact_every = compact_every
+        self._journal = None
+        self._records_since_snapshot = 0
+        self._history: Dict[str, Dict] = {}
+
+    def load(self) -> Dict:
+        """Чтение снимка и проигрывание хвоста журнала.
+
+        История остается внутри хранилища и читается через get_history.
+        """
+        state = self._read_snapshot()
+        count, valid_size = self._replay(state)
+        self._truncate_torn_tail(valid_size)
+        self._records_since_snapshot = count
+        # История упорядочена по времени завершения: устаревшие записи всегда в начале.
+        # Новые записи дописываются в конец, сортировка нужна только при загрузке
+        self._history = dict(sorted(state.pop("history").items(), key=lambda item: history_finished_at(item[1])))
+        return state
+
+    def append(self, records: List[Dict]):
+        """Дописывание записей в журнал"""
+        if not records:
+            return
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._journal.write(encode_record(records[0] if len(records) == 1 else {"b": records}))
+        self._journal.flush()
+        self._records_since_snapshot += len(records)
+
+        for record in records:
+            if record["t"] == "history":
+                apply_record({"history": self._history}, record)
+
+    def should_compact(self) -> bool:
+        return self._records_since_snapshot >= self.compact_every
+
+    def compact(self):
+        """Сворачивание журнала в новый снимок"""
+        state = self._read_snapshot()
+        self._replay(state)
+        self.replace_all(state)
+
+    def replace_all(self, state: Dict):
+        """Запись полного состояния в снимок с очисткой журнала"""
+        self._write_snapshot(state)
+
+        # Журнал обрезается только после того, как снимок записан на диск
+        self.close()
+        open(self.journal_path, 'w').close()
+        self._records_since_snapshot = 0
+
+    def sync(self):
+        """Сброс журнала на диск (fsync)"""
+        if self._journal is not None:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    # ========== ИСТОРИЯ ==========
+
+    def get_history(self, lobby_id: str) -> Optional[Dict]:
+        return self._history.get(lobby_id)
+
+    def count_history(self) -> int:
+        return len(self._history)
+
+    def history_status_counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for record in self._history.values():
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+        return counts
+
+    def expired_history(self, cutoff: float, limit: int) -> List[Dict]:
+        """Самые старые записи истории, завершенные раньше cutoff (epoch), не больше limit"""
+        expired = []
+        for record in self._history.values():
+            if len(expired) >= limit or history_finished_at(record) >= cutoff:
+                break
+            expired.append(record)
+        return expired
+
+    def iter_history(self) -> Iterator[Dict]:
+        return iter(list(self._history.values()))
+
+    def _read_snapshot(self) -> Dict:
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return empty_state()
+
+        for table in TABLES:
+            state.setdefault(table, {})
+        return state
+
+    def _write_snapshot(self, state: Dict):
+        temp_file = self.snapshot_path + '.tmp'
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, self.snapshot_path)
+        except Exception:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+
+    def _replay(self, state: Dict) -> tuple:
+        """Возвращает число примененных записей и размер целой части журнала"""
+        count = 0
+        valid_size = 0
+        try:
+            with open(self.journal_path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    batch = record["b"] if "b" in record else (record,)
+                    for item in batch:
+                        apply_record(state, item)
+                    count += len(batch)
+                    valid_size += len(line)
+        except FileNotFoundError:
+            pass
+        return count, valid_size
+
+    def _truncate_torn_tail(self, valid_size: int):
+        # Недописанная при падении строка склеилась бы со следующей записью
+        try:
+            if os.path.getsize(self.journal_path) > valid_size:
+                with open(self.journal_path, 'r+b') as f:
+                    f.truncate(valid_size)
+        except FileNotFoundError:
+            pass
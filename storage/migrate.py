@@ -0,0 +1,74 @@
+# storage/migrate.py
+"""Перенос данных между JSON-файлом и SQLite.
+
+Импорт:  python -m storage.migrate data/games.json data/games.sqlite3
+Экспорт: python -m storage.migrate --export data/games.sqlite3 data/games.json
+"""
+import argparse
+from typing import Dict, List
+
+from storage.journal import JournalStorage
+from storage.sqlite import SqliteStorage
+
+
+def storage_to_document(storage) -> Dict:
+    """Полное состояние хранилища в формате games.json"""
+    document = storage.load()
+    document["history"] = {record["lobby_id"]: record for record in storage.iter_history()}
+    return document
+
+
+def document_records(document: Dict) -> List[Dict]:
+    return [
+        {"t": table, "k": key, "v": value}
+        for table, rows in document.items()
+        for key, value in rows.items()
+    ]
+
+
+def import_json(json_path: str, sqlite_path: str) -> int:
+    """Одноразовый перенос games.json (со снимком и журналом) в SQLite"""
+    source = JournalStorage(json_path)
+    document = storage_to_document(source)
+    source.close()
+
+    target = SqliteStorage(sqlite_path)
+    try:
+        if target.count_history() or any(target.load().values()):
+            raise ValueError(f"База {sqlite_path} уже содержит данные")
+
+        records = document_records(document)
+        target.append(records)
+        target.compact()
+        return len(records)
+    finally:
+        target.close()
+
+
+def export_json(sqlite_path: str, json_path: str) -> int:
+    """Выгрузка SQLite в формат games.json"""
+    source = SqliteStorage(sqlite_path)
+    document = storage_to_document(source)
+    source.close()
+
+    target = JournalStorage(json_path)
+    target.replace_all(document)
+    return sum(len(rows) for rows in document.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос данных между games.json и SQLite")
+    parser.add_argument("source")
+    parser.add_argument("target")
+    parser.add_argument("--export", action="store_true", help="выгрузить SQLite в JSON")
+    args = parser.parse_args()
+
+    if args.export:
+        count = export_json(args.source, args.target)
+    else:
+        count = import_json(args.source, args.target)
+    print(f"Перенесено записей: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+# storage/sqlite.py
+import json
+import sqlite3
+from typing import Dict, List, Optional, Iterator
+
+from storage.journal import history_finished_at
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lobbies (
+    lobby_id TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    admin_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    winner TEXT,
+    scores TEXT,
+    finished INTEGER NOT NULL DEFAULT 0,
+    tournament_id TEXT,
+    created_at TEXT NOT NULL,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_lobbies_tournament ON lobbies(tournament_id);
+
+CREATE TABLE IF NOT EXISTS players (
+    lobby_id TEXT NOT NULL REFERENCES lobbies(lobby_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    connected INTEGER NOT NULL DEFAULT 0,
+    dice TEXT,
+    extra TEXT,
+    PRIMARY KEY (lobby_id, username)
+);
+
+CREATE TABLE IF NOT EXISTS history (
+    lobby_id TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    admin_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    winner TEXT,
+    scores TEXT,
+    tournament_id TEXT,
+    created_at TEXT NOT NULL,
+    players TEXT NOT NULL,
+    finished_at REAL,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_history_created ON history(created_at);
+CREATE INDEX IF NOT EXISTS idx_history_tournament ON history(tournament_id);
+
+CREATE TABLE IF NOT EXISTS tournaments (
+    tournament_id TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    admin_id INTEGER NOT NULL,
+    max_players INTEGER NOT NULL,
+    hours INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    lobbies TEXT NOT NULL,
+    channel_message_id INTEGER,
+    current_round INTEGER NOT NULL DEFAULT 1,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_tournaments_status ON tournaments(status);
+
+CREATE TABLE IF NOT EXISTS participants (
+    tournament_id TEXT NOT NULL REFERENCES tournaments(tournament_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    PRIMARY KEY (tournament_id, username)
+);
+
+CREATE TABLE IF NOT EXISTS temp_dice (
+    user_id TEXT PRIMARY KEY,
+    dice TEXT,
+    timestamp TEXT NOT NULL
+);
+
+-- Таблицы без собственной схемы хранятся как JSON
+CREATE TABLE IF NOT EXISTS records (
+    tbl TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (tbl, key)
+);
+"""
+
+LOBBY_COLUMNS = ("lobby_id", "chat_id", "admin_id", "status", "winner", "scores",
+                 "finished", "tournament_id", "created_at")
+HISTORY_COLUMNS = ("lobby_id", "chat_id", "admin_id", "status", "winner", "scores",
+                   "tournament_id", "created_at", "players", "finished_at")
+TOURNAMENT_COLUMNS = ("tournament_id", "chat_id", "admin_id", "max_players", "hours", "status",
+                      "created_at", "lobbies", "channel_message_id", "current_round")
+JSON_COLUMNS = {"scores", "players", "lobbies"}
+
+
+def _dumps(value) -> Optional[str]:
+    if value is None:
+        return None
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def _loads(value: Optional[str]):
+    return json.loads(value) if value is not None else None
+
+
+def _split(record: Dict, columns: tuple, skip: tuple = ()) -> tuple:
+    """Разделение записи на значения колонок и JSON с остальными полями"""
+    values = [_dumps(record.get(c)) if c in JSON_COLUMNS else record.get(c) for c in columns]
+    extra = {k: v for k, v in record.items() if k not in columns and k not in skip}
+    return values, _dumps(extra) if extra else None
+
+
+def _join(row: sqlite3.Row, columns: tuple) -> Dict:
+    record = {c: _loads(row[c]) if c in JSON_COLUMNS else row[c] for c in columns}
+    if row["extra"]:
+        record.update(json.loads(row["extra"]))
+    return record
+
+
+def _player_row(lobby_id: str, position: int, username: str, player: Dict) -> tuple:
+    extra = {k: v for k, v in player.items() if k not in ("connected", "dice")}
+    return (lobby_id, position, username, int(bool(player.get("connected"))),
+            _dumps(player.get("dice")), _dumps(extra) if extra else None)
+
+
+class SqliteStorage:
+    """Хранилище в SQLite (WAL) с тем же интерфейсом, что и JournalStorage.
+
+    Запись идет только через отдельное соединение писателя, чтение
+    истории - через свое соединение, которое WAL не блокирует.
+    """
+
+    def __init__(self, path: str, compact_every: int = 1000):
+        self.path = path
+        self.compact_every = compact_every
+        self._records_since_checkpoint = 0
+
+        self._writer = self._connect()
+        self._writer.executescript(SCHEMA)
+        self._upgrade_history()
+        self._reader = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def _upgrade_history(self):
+        """Колонка finished_at для баз, созданных до ее появления"""
+        columns = {row["name"] for row in self._writer.execute("PRAGMA table_info(history)")}
+        with self._writer as conn:
+            if "finished_at" not in columns:
+                conn.execute("ALTER TABLE history ADD COLUMN finished_at REAL")
+                rows = conn.execute("SELECT lobby_id, created_at FROM history").fetchall()
+                conn.executemany(
+                    "UPDATE history SET finished_at = ? WHERE lobby_id = ?",
+                    [(history_finished_at({"created_at": row["created_at"]}), row["lobby_id"]) for row in rows]
+                )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_history_finished ON history(finished_at)")
+
+    # ========== ЗАГРУЗКА ==========
+
+    def load(self) -> Dict:
+        """Загрузка активного состояния (история читается по запросу)"""
+        conn = self._reader
+        state = {"lobbies": {}, "tournaments": {}, "temp_dice": {}, "timers": {}}
+
+        for row in conn.execute("SELECT * FROM lobbies"):
+            lobby = _join(row, LOBBY_COLUMNS)
+            lobby["finished"] = bool(lobby["finished"])
+            lobby["players"] = {}
+            state["lobbies"][lobby["lobby_id"]] = lobby
+
+        for row in conn.execute("SELECT * FROM players ORDER BY lobby_id, position"):
+            lobby = state["lobbies"].get(row["lobby_id"])
+            if lobby is not None:
+                player = {"connected": bool(row["connected"]), "dice": _loads(row["dice"])}
+                if row["extra"]:
+                    player.update(json.loads(row["extra"]))
+                lobby["players"][row["username"]] = player
+
+        for row in conn.execute("SELECT * FROM tournaments"):
+            tournament = _join(row, TOURNAMENT_COLUMNS)
+            tournament["participants"] = []
+            state["tournaments"][tournament["tournament_id"]] = tournament
+
+        for row in conn.execute("SELECT * FROM participants ORDER BY tournament_id, position"):
+            tournament = state["tournaments"].get(row["tournament_id"])
+            if tournament is not None:
+                tournament["participants"].append(row["username"])
+
+        for row in conn.execute("SELECT * FROM temp_dice"):
+            state["temp_dice"][row["user_id"]] = {"dice": _loads(row["dice"]), "timestamp": row["timestamp"]}
+
+        for row in conn.execute("SELECT tbl, key, value FROM records"):
+            state.setdefault(row["tbl"], {})[row["key"]] = json.loads(row["value"])
+
+        return state
+
+    # ========== ЗАПИСЬ ==========
+
+    def append(self, records: List[Dict]):
+        """Применение пачки записей одной транзакцией"""
+        if not records:
+            return
+        with self._writer as conn:
+            for record in records:
+                table, key = record["t"], record["k"]
+                if "v" in record:
+                    self._put(conn, table, key, record["v"])
+                else:
+                    self._delete(conn, table, key)
+        self._records_since_checkpoint += len(records)
+
+    def _put(self, conn: sqlite3.Connection, table: str, key: str, value: Dict):
+        if table == "lobbies":
+            values, extra = _split(value, LOBBY_COLUMNS, skip=("players",))
+            values[LOBBY_COLUMNS.index("finished")] = int(bool(value.get("finished")))
+            conn.execute(
+                f"INSERT OR REPLACE INTO lobbies ({', '.join(LOBBY_COLUMNS)}, extra) "
+                f"VALUES ({', '.join('?' * (len(LOBBY_COLUMNS) + 1))})",
+                (*values, extra)
+            )
+            conn.execute("DELETE FROM players WHERE lobby_id = ?", (key,))
+            conn.executemany(
+                "INSERT INTO players (lobby_id, position, username, connected, dice, extra) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    _player_row(key, position, username, player)
+                    for position, (username, player) in enumerate(value.get("players", {}).items())
+                ]
+            )
+        elif table == "history":
+            values, extra = _split(value, HISTORY_COLUMNS, skip=("finished",))
+            values[HISTORY_COLUMNS.index("finished_at")] = history_finished_at(value)
+            conn.execute(
+                f"INSERT OR REPLACE INTO history ({', '.join(HISTORY_COLUMNS)}, extra) "
+                f"VALUES ({', '.join('?' * (len(HISTORY_COLUMNS) + 1))})",
+                (*values, extra)
+            )
+        elif table == "tournaments":
+            values, extra = _split(value, TOURNAMENT_COLUMNS, skip=("participants",))
+            conn.execute(
+                f"INSERT OR REPLACE INTO tournaments ({', '.join(TOURNAMENT_COLUMNS)}, extra) "
+                f"VALUES ({', '.join('?' * (len(TOURNAMENT_COLUMNS) + 1))})",
+                (*values, extra)
+            )
+            conn.execute("DELETE FROM participants WHERE tournament_id = ?", (key,))
+            conn.executemany(
+                "INSERT INTO participants (tournament_id, position, username) VALUES (?, ?, ?)",
+                [(key, position, username) for position, username in enumerate(value.get("participants", []))]
+            )
+        elif table == "temp_dice":
+            conn.execute(
+                "INSERT OR REPLACE INTO temp_dice (user_id, dice, timestamp) VALUES (?, ?, ?)",
+                (key, _dumps(value.get("dice")), value.get("timestamp"))
+            )
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO records (tbl, key, value) VALUES (?, ?, ?)",
+                (table, key, _dumps(value))
+            )
+
+    def _delete(self, conn: sqlite3.Connection, table: str, key: str):
+        if table == "lobbies":
+            conn.execute("DELETE FROM lobbies WHERE lobby_id = ?", (key,))
+        elif table == "history":
+            conn.execute("DELETE FROM history WHERE lobby_id = ?", (key,))
+        elif table == "tournaments":
+            conn.execute("DELETE FROM tournaments WHERE tournament_id = ?", (key,))
+        elif table == "temp_dice":
+            conn.execute("DELETE FROM temp_dice WHERE user_id = ?", (key,))
+        else:
+            conn.execute("DELETE FROM records WHERE tbl = ? AND key = ?", (table, key))
+
+    def should_compact(self) -> bool:
+        return self._records_since_checkpoint >= self.compact_every
+
+    def compact(self):
+        """Перенос WAL в основной файл базы"""
+        self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._records_since_checkpoint = 0
+
+    def sync(self):
+        self._writer.execute("PRAGMA wal_checkpoint(FULL)")
+
+    def close(self):
+        self._writer.close()
+        self._reader.close()
+
+    # ========== ИСТОРИЯ ==========
+
+    def get_history(self, lobby_id: str) -> Optional[Dict]:
+        row = self._reader.execute("SELECT * FROM history WHERE lobby_id = ?", (lobby_id,)).fetchone()
+        if row is None:
+            return None
+        record = _join(row, HISTORY_COLUMNS)
+        record["finished"] = True
+        return record
+
+    def count_history(self) -> int:
+        return self._reader.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def history_status_counts(self) -> Dict[str, int]:
+        rows = self._reader.execute("SELECT status, COUNT(*) FROM history GROUP BY status")
+        return {status: count for status, count in rows}
+
+    def expired_history(self, cutoff: float, limit: int) -> List[Dict]:
+        """Самые старые записи истории, завершенные раньше cutoff (epoch), не больше limit"""
+        rows = self._reader.execute(
+            "SELECT * FROM history WHERE finished_at < ? ORDER BY finished_at LIMIT ?", (cutoff, limit)
+        )
+        expired = []
+        for row in rows:
+            record = _join(row, HISTORY_COLUMNS)
+            record["finished"] = True
+            expired.append(record)
+        return expired
+
+    def iter_history(self) -> Iterator[Dict]:
+        for row in self._reader.execute("SELECT * FROM history ORDER BY finished_at"):
+            record = _join(row, HISTORY_COLUMNS)
+            record["finished"] = True
+            yield record
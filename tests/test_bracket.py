@@ -0,0 +1,145 @@
+# tests/test_bracket.py
+import pytest
+
+from services.bracket import EMPTY, attach_lobby, champion, create_bracket, ready_matches, record_result, round_of
+
+SIZES = range(2, 20)
+
+
+def players(count: int) -> list:
+    return [f"p{i:02d}" for i in range(count)]
+
+
+def bracket_size(count: int) -> int:
+    size = 2
+    while size < count:
+        size *= 2
+    return size
+
+
+def first_round(count: int) -> dict:
+    """Ожидаемый посев: первые size - n участников проходят без игры,
+    остальные играют парами по порядку. Узел пары j - size // 2 + j"""
+    size = bracket_size(count)
+    byes = size - count
+    names = players(count)
+    pairs = {}
+    for pair in range(size // 2):
+        if pair < byes:
+            pairs[size // 2 + pair] = (names[pair], EMPTY)
+        else:
+            first = byes + 2 * (pair - byes)
+            pairs[size // 2 + pair] = (names[first], names[first + 1])
+    return pairs
+
+
+def play_out(bracket: dict, pick_winner) -> list:
+    """Доигрывание сетки; возвращает сыгранные матчи по порядку"""
+    played = []
+    pending = ready_matches(bracket)
+    while pending:
+        node, player1, player2 = pending.pop(0)
+        attach_lobby(bracket, node, f"lobby{node}")
+        played.append((node, player1, player2))
+        pending.extend(record_result(bracket, node, pick_winner(player1, player2)))
+    return played
+
+
+@pytest.mark.parametrize("count", SIZES)
+def test_seeding_and_byes(count):
+    bracket = create_bracket(players(count))
+    size = bracket_size(count)
+    assert bracket["size"] == size
+    assert len(bracket["slots"]) == 2 * size
+
+    for node, (player1, player2) in first_round(count).items():
+        assert bracket["slots"][2 * node:2 * node + 2] == [player1, player2]
+        # Пара с пустым слотом сразу проходит дальше, настоящая пара ждет матча
+        assert bracket["slots"][node] == (player1 if player2 == EMPTY else None)
+
+
+@pytest.mark.parametrize("count", SIZES)
+def test_first_ready_matches(count):
+    bracket = create_bracket(players(count))
+    expected = {node: pair for node, pair in first_round(count).items() if EMPTY not in pair}
+
+    # Две соседние пары с проходом без игры дают матч второго раунда уже при посеве
+    slots = bracket["slots"]
+    for node in range(bracket["size"] // 2 - 1, 0, -1):
+        if slots[node] is None and slots[2 * node] and slots[2 * node + 1]:
+            expected[node] = (slots[2 * node], slots[2 * node + 1])
+
+    matches = ready_matches(bracket)
+    assert {node: (player1, player2) for node, player1, player2 in matches} == expected
+    assert [node for node, _, _ in matches] == sorted(expected, reverse=True)
+
+
+@pytest.mark.parametrize("count, matches", [
+    (2, [(1, "p00", "p01")]),
+    (3, [(3, "p01", "p02")]),
+    (5, [(7, "p03", "p04"), (2, "p00", "p01")]),
+    (6, [(7, "p04", "p05"), (6, "p02", "p03"), (2, "p00", "p01")]),
+    (8, [(7, "p06", "p07"), (6, "p04", "p05"), (5, "p02", "p03"), (4, "p00", "p01")]),
+    (9, [(15, "p07", "p08"), (6, "p04", "p05"), (5, "p02", "p03"), (4, "p00", "p01")])
+])
+def test_known_pairings(count, matches):
+    assert ready_matches(create_bracket(players(count))) == matches
+
+
+@pytest.mark.parametrize("count", SIZES)
+@pytest.mark.parametrize("lower_wins", [True, False])
+def test_champion_propagation(count, lower_wins):
+    bracket = create_bracket(players(count))
+    played = play_out(bracket, lambda a, b: min(a, b) if lower_wins else max(a, b))
+
+    # Выбывание: каждый матч выбивает ровно одного игрока
+    assert len(played) == count - 1
+    assert champion(bracket) == (players(count)[0] if lower_wins else players(count)[-1])
+    assert bracket["slots"][1] == champion(bracket)
+    assert played[-1][0] == 1
+
+    # Никто не играет дважды за раунд, матчи идут снизу вверх
+    rounds = {}
+    for node, player1, player2 in played:
+        seen = rounds.setdefault(round_of(bracket, node), set())
+        assert not {player1, player2} & seen
+        seen.update((player1, player2))
+    assert max(rounds) == bracket["size"].bit_length() - 1
+    for node, _, _ in played:
+        assert bracket["slots"][node] in (bracket["slots"][2 * node], bracket["slots"][2 * node + 1])
+
+
+@pytest.mark.parametrize("count, forfeit_node, expected_played, expected_champion", [
+    # Финал без победителя: турнир заканчивается без чемпиона
+    (2, 1, [], None),
+    # Соперник по финалу проходит без игры
+    (4, 3, [(2, "p00", "p01")], "p00"),
+    # Победитель соседнего матча попадает в финал без игры во втором раунде
+    (6, 7, [(6, "p02", "p03"), (2, "p00", "p01"), (1, "p00", "p02")], "p00")
+])
+def test_double_forfeit_passes_opponent(count, forfeit_node, expected_played, expected_champion):
+    """Матч без победителя (оба не бросили) пропускает соперника дальше по сетке"""
+    bracket = create_bracket(players(count))
+    attach_lobby(bracket, forfeit_node, "lobby")
+    pending = record_result(bracket, forfeit_node, None)
+    assert bracket["slots"][forfeit_node] == EMPTY
+
+    assert pending == []
+    assert play_out(bracket, min) == expected_played
+    assert champion(bracket) == expected_champion
+
+
+def test_repeated_result_is_ignored():
+    bracket = create_bracket(players(4))
+    node, player1, _ = ready_matches(bracket)[0]
+    attach_lobby(bracket, node, "lobby")
+    record_result(bracket, node, player1)
+    assert record_result(bracket, node, None) == []
+    assert bracket["slots"][node] == player1
+
+
+def test_round_numbers():
+    bracket = create_bracket(players(16))
+    assert round_of(bracket, 1) == 4
+    assert round_of(bracket, 2) == round_of(bracket, 3) == 3
+    assert round_of(bracket, 8) == round_of(bracket, 15) == 1
\ No newline at end of file
@@ -0,0 +1,98 @@
+# tests/test_rate_limit.py
+import pytest
+
+from cache import CacheManager, RateLimitState, _TAT_TOLERANCE
+
+
+class FakeClock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def burst(cache: CacheManager, key: str, limit: int, period: float) -> int:
+    """Сколько запросов подряд пропускает лимит в один момент времени"""
+    passed = 0
+    while cache.check_rate_limit(key, limit, period):
+        passed += 1
+        assert passed <= limit
+    return passed
+
+
+@pytest.mark.parametrize("now", [0.0, 1.0, 1234.567, 1e6 + 0.1, 1.7e9 + 0.3, 2e9 - 0.7])
+@pytest.mark.parametrize("limit, period", [(3, 10), (5, 60), (10, 1), (7, 0.3)])
+def test_burst_passes_exactly_limit(now, limit, period):
+    cache = CacheManager(timer=FakeClock(now))
+    assert burst(cache, "user", limit, period) == limit
+
+
+@pytest.mark.parametrize("now", [1.0, 1.7e9 + 0.3])
+def test_one_slot_frees_per_emission_interval(now):
+    clock = FakeClock(now)
+    cache = CacheManager(timer=clock)
+    assert burst(cache, "user", 5, 60) == 5
+
+    # Интервал между запросами - period / limit = 12 с
+    clock.now += 12 - 1e-3
+    assert not cache.check_rate_limit("user", 5, 60)
+    clock.now += 1e-3
+    assert cache.check_rate_limit("user", 5, 60)
+    assert not cache.check_rate_limit("user", 5, 60)
+
+    # Через полный период доступна вся пачка
+    clock.now += 60
+    assert burst(cache, "user", 5, 60) == 5
+
+
+def test_tolerance_boundary():
+    now = 1000.0
+    cache = CacheManager(timer=FakeClock(now))
+    step = 10 / 5
+
+    # Новый tat дальше периода меньше чем на допуск - запрос проходит
+    cache.rate_limit_cache["inside"] = RateLimitState(now + 10 - step + _TAT_TOLERANCE / 2)
+    assert cache.check_rate_limit("inside", 5, 10)
+
+    # На два допуска дальше - уже превышение
+    cache.rate_limit_cache["outside"] = RateLimitState(now + 10 - step + 2 * _TAT_TOLERANCE)
+    assert not cache.check_rate_limit("outside", 5, 10)
+
+
+def test_rejected_check_charges_no_limit():
+    cache = CacheManager(timer=FakeClock(50.0))
+    assert burst(cache, "chat", 2, 10) == 2
+
+    # Пользовательский лимит не расходуется, если отказал лимит чата
+    for _ in range(3):
+        assert cache.check_rate_limits((("user", 3, 10), ("chat", 2, 10))) == "chat"
+    assert burst(cache, "user", 3, 10) == 3
+
+
+def test_state_expires_at_tat():
+    clock = FakeClock(100.0)
+    cache = CacheManager(timer=clock)
+    for _ in range(3):
+        assert cache.check_rate_limit("user", 3, 30)
+    tat = cache.rate_limit_cache["user"].tat
+    assert tat == pytest.approx(130.0)
+
+    clock.now = tat - 1e-3
+    assert "user" in cache.rate_limit_cache
+    clock.now = tat
+    assert "user" not in cache.rate_limit_cache
+    assert len(cache.rate_limit_cache) == 0
+
+    # Выброшенный ключ ведет себя как новый
+    assert burst(cache, "user", 3, 30) == 3
+
+
+def test_expired_keys_do_not_hold_capacity():
+    clock = FakeClock(0.0)
+    cache = CacheManager(timer=clock)
+    for user in range(100):
+        assert cache.check_rate_limit(f"user{user}", 1, 1)
+    clock.now = 1.0
+    cache.rate_limit_cache.expire()
+    assert len(cache.rate_limit_cache) == 0
\ No newline at end of file
@@ -0,0 +1,35 @@
+# utils/locks.py
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable
+
+class _KeyedEntry:
+    __slots__ = ("lock", "users")
+    
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+class KeyedLock:
+    """Блокировка по ключу: разные ключи выполняются параллельно, один ключ - строго по очереди.
+    Запись удаляется, когда ее больше никто не ждет, поэтому память не растет с числом ключей"""
+    
+    def __init__(self):
+        self._entries: Dict[Hashable, _KeyedEntry] = {}
+        
+    @asynccontextmanager
+    async def __call__(self, key: Hashable) -> AsyncIterator[None]:
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _KeyedEntry()
+        entry.users += 1
+        try:
+            async with entry.lock:
+                yield
+        finally:
+            entry.users -= 1
+            if entry.users == 0:
+                del self._entries[key]
+                
+    def __len__(self) -> int:
+        return len(self._entries)
\ No newline at end of file